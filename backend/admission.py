@@ -0,0 +1,160 @@
+"""Admission control for the ingestion endpoints.
+
+Each user_id and service gets a token bucket refilled at a steady event rate,
+and a global cap limits how many ingest requests may be writing at once.
+Requests over either limit are rejected up front with a Retry-After hint
+instead of queueing behind a saturated database.
+"""
+import math
+import os
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Events per second and burst size; a rate of 0 disables the limit
+ADMISSION_USER_RATE = float(os.environ.get('ADMISSION_USER_RATE', '0'))
+ADMISSION_USER_BURST = float(os.environ.get('ADMISSION_USER_BURST', '0')) or ADMISSION_USER_RATE * 10
+ADMISSION_SERVICE_RATE = float(os.environ.get('ADMISSION_SERVICE_RATE', '0'))
+ADMISSION_SERVICE_BURST = float(os.environ.get('ADMISSION_SERVICE_BURST', '0')) or ADMISSION_SERVICE_RATE * 10
+# Concurrent ingest requests allowed in the write pipeline; 0 disables the cap
+ADMISSION_MAX_INFLIGHT = int(os.environ.get('ADMISSION_MAX_INFLIGHT', '64'))
+ADMISSION_MAX_KEYS = int(os.environ.get('ADMISSION_MAX_KEYS', '10000'))
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'admitted', 'throttled')
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+        self.admitted = 0
+        self.throttled = 0
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost: float) -> float:
+        """Seconds until ``cost`` events fit; a batch larger than the burst needs a full bucket"""
+        needed = min(cost, self.burst)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        user_rate: float = ADMISSION_USER_RATE,
+        user_burst: float = ADMISSION_USER_BURST,
+        service_rate: float = ADMISSION_SERVICE_RATE,
+        service_burst: float = ADMISSION_SERVICE_BURST,
+        max_inflight: int = ADMISSION_MAX_INFLIGHT,
+        max_keys: int = ADMISSION_MAX_KEYS
+    ):
+        self.limits = {
+            'user_id': (user_rate, user_burst),
+            'service': (service_rate, service_burst),
+        }
+        self.max_inflight = max_inflight
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[Tuple[str, str], TokenBucket]" = OrderedDict()
+        self.inflight = 0
+        self.write_seconds = 0.05  # moving average of time spent in the write pipeline
+        self.totals = Counter()
+
+    def _bucket(self, scope: str, key: str, now: float) -> Optional[TokenBucket]:
+        rate, burst = self.limits[scope]
+        if rate <= 0:
+            return None
+        bucket = self.buckets.get((scope, key))
+        if bucket is None:
+            bucket = self.buckets[(scope, key)] = TokenBucket(rate, burst, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end((scope, key))
+            bucket.refill(now)
+        return bucket
+
+    def admit(self, costs: Dict[Tuple[str, str], int], now: Optional[float] = None) -> None:
+        """Charge events per (scope, key); all-or-nothing, raises AdmissionRejected"""
+        now = time.monotonic() if now is None else now
+        buckets = []
+        retry_after = 0.0
+        for (scope, key), cost in costs.items():
+            bucket = self._bucket(scope, key, now)
+            if bucket is None:
+                continue
+            buckets.append((bucket, cost))
+            retry_after = max(retry_after, bucket.wait_time(cost))
+
+        if retry_after > 0:
+            for bucket, cost in buckets:
+                if bucket.wait_time(cost) > 0:
+                    bucket.throttled += 1
+            self.totals['throttled'] += 1
+            raise AdmissionRejected("Rate limit exceeded", retry_after)
+
+        for bucket, cost in buckets:
+            bucket.tokens -= cost
+            bucket.admitted += cost
+        self.totals['admitted'] += 1
+
+    def acquire_write_slot(self) -> float:
+        """Reserve a slot in the write pipeline; returns the start time for release"""
+        if self.max_inflight and self.inflight >= self.max_inflight:
+            self.totals['overloaded'] += 1
+            # Roughly how long until the pipeline has drained a full round of writes
+            raise AdmissionRejected("Ingestion is over capacity", self.write_seconds * self.inflight / self.max_inflight)
+        self.inflight += 1
+        return time.monotonic()
+
+    def release_write_slot(self, started: float) -> None:
+        self.inflight -= 1
+        self.write_seconds = 0.9 * self.write_seconds + 0.1 * (time.monotonic() - started)
+
+    def stats(self, top: int = 20) -> Dict[str, object]:
+        throttled: List[Dict[str, object]] = [
+            {"scope": scope, "key": key, "throttled": bucket.throttled, "admitted_events": bucket.admitted,
+             "tokens": round(bucket.tokens, 2)}
+            for (scope, key), bucket in self.buckets.items() if bucket.throttled
+        ]
+        throttled.sort(key=lambda entry: entry["throttled"], reverse=True)
+        return {
+            "inflight_writes": self.inflight,
+            "max_inflight_writes": self.max_inflight,
+            "avg_write_seconds": round(self.write_seconds, 4),
+            "admitted_requests": self.totals['admitted'],
+            "throttled_requests": self.totals['throttled'],
+            "overloaded_requests": self.totals['overloaded'],
+            "tracked_keys": len(self.buckets),
+            "top_throttled": throttled[:top],
+        }
+
+
+def event_costs(events: List[Any]) -> Dict[Tuple[str, str], int]:
+    """Count events per (scope, key) for a list of raw event payloads"""
+    costs: Counter = Counter()
+    for event in events:
+        # Non-object items are reported as invalid later and cost nothing
+        if not isinstance(event, dict):
+            continue
+        for scope in ('user_id', 'service'):
+            key = event.get(scope)
+            if isinstance(key, str):
+                costs[(scope, key)] += 1
+    return costs
@@ -0,0 +1,277 @@
+"""Streaming budget and rate-of-change alerts over sliding windows.
+
+Each rule keeps one ring buffer of time buckets per key (user, service or
+model). A ring covers two windows so a rule can compare the current window
+with the previous one; running sums for both halves are updated as buckets
+rotate, making every observation O(1) per rule. Windows are kept for the
+ALERT_MAX_KEYS most recently seen keys per rule.
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from enum import Enum
+from typing import Any, Dict, Iterable, List, Optional
+
+from pydantic import BaseModel, Field
+
+ALERT_RULES = os.environ.get('ALERT_RULES')
+ALERT_RULES_FILE = os.environ.get('ALERT_RULES_FILE')
+ALERT_WEBHOOK_URL = os.environ.get('ALERT_WEBHOOK_URL')
+ALERTS_COLLECTION = 'ai_usage_alerts'
+ALERT_BUCKETS_PER_WINDOW = int(os.environ.get('ALERT_BUCKETS_PER_WINDOW', '60'))
+ALERT_MAX_KEYS = int(os.environ.get('ALERT_MAX_KEYS', '10000'))
+
+
+class AlertKind(str, Enum):
+    BUDGET = "budget"
+    RATE_CHANGE = "rate_change"
+
+
+class AlertScope(str, Enum):
+    USER = "user_id"
+    SERVICE = "service"
+    MODEL = "model"
+
+
+class AlertMeasure(str, Enum):
+    COST = "cost"
+    TOKENS = "tokens"
+    EVENTS = "events"
+
+
+class AlertRule(BaseModel):
+    name: str
+    kind: AlertKind
+    scope: AlertScope
+    measure: AlertMeasure = AlertMeasure.COST
+    window_seconds: int = Field(3600, ge=60)
+    # Budget: alert when the window total exceeds threshold.
+    # Rate change: alert when current / previous window exceeds threshold.
+    threshold: float = Field(..., gt=0)
+    # Rate change rules ignore windows whose baseline is below this value
+    min_baseline: float = 0.0
+    # Only track this key (e.g. a single user); all keys when unset
+    key: Optional[str] = None
+    cooldown_seconds: int = Field(3600, ge=0)
+
+
+class Alert(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    rule: str
+    kind: AlertKind
+    scope: AlertScope
+    key: str
+    measure: AlertMeasure
+    value: float
+    baseline: Optional[float] = None
+    threshold: float
+    window_seconds: int
+    triggered_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class SlidingWindow:
+    """Ring buffer of buckets spanning the current and previous window"""
+
+    __slots__ = ('bucket_seconds', 'size', 'buckets', 'head', 'current', 'previous')
+
+    def __init__(self, window_seconds: int, buckets: int):
+        self.bucket_seconds = max(1, window_seconds // buckets)
+        self.size = buckets
+        self.buckets = [0.0] * (2 * buckets)
+        self.head: Optional[int] = None
+        self.current = 0.0
+        self.previous = 0.0
+
+    def _slot(self, index: int) -> int:
+        return index % len(self.buckets)
+
+    def advance(self, index: int) -> None:
+        """Rotate the ring forward so ``index`` is the newest bucket"""
+        if self.head is None:
+            self.head = index
+            return
+        steps = index - self.head
+        if steps <= 0:
+            return
+        if steps >= len(self.buckets):
+            self.buckets = [0.0] * len(self.buckets)
+            self.current = self.previous = 0.0
+            self.head = index
+            return
+        for _ in range(steps):
+            self.head += 1
+            # Oldest current bucket moves into the previous window
+            moved = self.buckets[self._slot(self.head - self.size)]
+            self.current -= moved
+            self.previous += moved
+            # Oldest previous bucket expires and its slot is reused
+            expired = self.buckets[self._slot(self.head)]
+            self.previous -= expired
+            self.buckets[self._slot(self.head)] = 0.0
+
+    def add(self, timestamp: float, value: float) -> bool:
+        """Add value at timestamp; returns False when it is older than the ring"""
+        index = int(timestamp // self.bucket_seconds)
+        self.advance(index)
+        age = self.head - index
+        if age >= len(self.buckets):
+            return False
+        self.buckets[self._slot(index)] += value
+        if age < self.size:
+            self.current += value
+        else:
+            self.previous += value
+        return True
+
+
+def event_measure(measure: AlertMeasure, event: Dict[str, Any]) -> float:
+    if measure == AlertMeasure.COST:
+        return event.get('cost_usd') or 0.0
+    if measure == AlertMeasure.TOKENS:
+        return event.get('total_tokens') or 0
+    return 1.0
+
+
+def _epoch(timestamp: datetime) -> float:
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+class AlertEvaluator:
+    """Evaluates alert rules against a stream of usage events"""
+
+    def __init__(self, rules: List[AlertRule], buckets: int = ALERT_BUCKETS_PER_WINDOW, max_keys: int = ALERT_MAX_KEYS):
+        self.rules = rules
+        self.buckets = buckets
+        self.max_keys = max_keys
+        self.windows: List["OrderedDict[str, SlidingWindow]"] = [OrderedDict() for _ in rules]
+        self.last_fired: Dict[tuple, float] = {}
+        self.events_observed = 0
+
+    @property
+    def max_window_seconds(self) -> int:
+        return max((rule.window_seconds for rule in self.rules), default=0)
+
+    @property
+    def max_cooldown_seconds(self) -> int:
+        return max((rule.cooldown_seconds for rule in self.rules), default=0)
+
+    def restore_cooldowns(self, alerts: Iterable[Dict[str, Any]]) -> None:
+        """Seed cooldowns from stored alerts so a restart doesn't re-raise them"""
+        for alert in alerts:
+            fired_key = (alert['rule'], alert['key'])
+            fired_at = _epoch(alert['triggered_at'])
+            self.last_fired[fired_key] = max(fired_at, self.last_fired.get(fired_key, fired_at))
+
+    def observe(self, event: Dict[str, Any], emit: bool = True) -> List[Alert]:
+        """Feed one event through every rule, returning alerts that fired"""
+        self.events_observed += 1
+        timestamp = _epoch(event['timestamp'])
+        alerts = []
+        for rule, windows in zip(self.rules, self.windows):
+            key = event.get(rule.scope.value)
+            if key is None or (rule.key is not None and key != rule.key):
+                continue
+            window = windows.get(key)
+            if window is None:
+                window = windows[key] = SlidingWindow(rule.window_seconds, self.buckets)
+                if len(windows) > self.max_keys:
+                    # Drop the least recently seen key along with its cooldown
+                    evicted, _ = windows.popitem(last=False)
+                    self.last_fired.pop((rule.name, evicted), None)
+            else:
+                windows.move_to_end(key)
+            if not window.add(timestamp, event_measure(rule.measure, event)) or not emit:
+                continue
+            alert = self.check(rule, key, window, timestamp)
+            if alert:
+                alerts.append(alert)
+        return alerts
+
+    def check(self, rule: AlertRule, key: str, window: SlidingWindow, timestamp: float) -> Optional[Alert]:
+        baseline = None
+        if rule.kind == AlertKind.BUDGET:
+            triggered = window.current > rule.threshold
+        else:
+            baseline = window.previous
+            triggered = (baseline > 0 and baseline >= rule.min_baseline
+                         and window.current > baseline * rule.threshold)
+        if not triggered:
+            return None
+
+        fired_key = (rule.name, key)
+        last = self.last_fired.get(fired_key)
+        if last is not None and timestamp - last < rule.cooldown_seconds:
+            return None
+        self.last_fired[fired_key] = timestamp
+        return Alert(
+            rule=rule.name,
+            kind=rule.kind,
+            scope=rule.scope,
+            key=key,
+            measure=rule.measure,
+            value=round(window.current, 6),
+            baseline=round(baseline, 6) if baseline is not None else None,
+            threshold=rule.threshold,
+            window_seconds=rule.window_seconds
+        )
+
+
+def load_rules() -> List[AlertRule]:
+    """Load rules from ALERT_RULES (JSON) or ALERT_RULES_FILE"""
+    raw = ALERT_RULES
+    if not raw and ALERT_RULES_FILE:
+        with open(ALERT_RULES_FILE) as f:
+            raw = f.read()
+    if not raw:
+        return []
+    return [AlertRule(**rule) for rule in json.loads(raw)]
+
+
+def post_webhook(alert: Alert) -> None:
+    import requests
+    response = requests.post(ALERT_WEBHOOK_URL, data=alert.json(), headers={'Content-Type': 'application/json'}, timeout=5)
+    response.raise_for_status()
+
+
+class AlertDispatcher:
+    """Delivers alerts off the ingest path to the alerts collection and webhook"""
+
+    def __init__(self, db):
+        self.db = db
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=10000)
+        self.task: Optional[asyncio.Task] = None
+        self.dropped = 0
+
+    def submit(self, alerts: List[Alert]) -> None:
+        for alert in alerts:
+            try:
+                self.queue.put_nowait(alert)
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+    async def run(self) -> None:
+        while True:
+            alert = await self.queue.get()
+            logging.warning(f"Alert {alert.rule}: {alert.scope.value}={alert.key} {alert.measure.value}={alert.value}")
+            try:
+                await self.db[ALERTS_COLLECTION].insert_one(alert.dict())
+            except Exception as e:
+                logging.error(f"Failed to store alert: {e}")
+            if ALERT_WEBHOOK_URL:
+                try:
+                    await asyncio.to_thread(post_webhook, alert)
+                except Exception as e:
+                    logging.error(f"Alert webhook failed: {e}")
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
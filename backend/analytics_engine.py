@@ -0,0 +1,388 @@
+"""Embedded columnar mirror of ai_usage_events for ad-hoc analytics.
+
+Events are appended from the ingest path into a local DuckDB table and
+caught up from MongoDB at startup, so arbitrary group-bys run as columnar
+scans instead of Mongo aggregation pipelines over row documents.
+
+Events written by other processes (bulk imports, backfills) don't pass through
+the ingest path and usually carry historical timestamps, so a timestamp-based
+catch-up can't find them. Those writers call ``request_resync`` with the
+earliest timestamp they wrote. Each request is kept in MongoDB with an
+increasing version, and every mirror records the last version it applied, so
+each API server (running now or started later) re-mirrors every backfill once.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+ROOT_DIR = Path(__file__).parent
+
+ANALYTICS_ENGINE_ENABLED = os.environ.get('ANALYTICS_ENGINE', 'duckdb').lower() == 'duckdb'
+ANALYTICS_DB_PATH = os.environ.get('ANALYTICS_DB_PATH', str(ROOT_DIR / 'analytics.duckdb'))
+ANALYTICS_FLUSH_ROWS = int(os.environ.get('ANALYTICS_FLUSH_ROWS', '5000'))
+ANALYTICS_FLUSH_INTERVAL = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', '1.0'))
+ANALYTICS_SYNC_LOOKBACK_HOURS = int(os.environ.get('ANALYTICS_SYNC_LOOKBACK_HOURS', '24'))
+ANALYTICS_RESYNC_INTERVAL = float(os.environ.get('ANALYTICS_RESYNC_INTERVAL', '60'))
+
+# Resync requests left by out-of-process writers: a version counter document
+# plus one document per request
+SYNC_COLLECTION = 'ai_usage_sync'
+MIRROR_SYNC_ID = 'analytics_mirror'
+
+COLUMNS = [
+    'id', 'ts', 'provider', 'model', 'event_type', 'user_id', 'service',
+    'prompt_tokens', 'completion_tokens', 'total_tokens', 'cost_usd', 'has_pii', 'metadata',
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id VARCHAR PRIMARY KEY,
+    ts TIMESTAMP NOT NULL,
+    provider VARCHAR,
+    model VARCHAR,
+    event_type VARCHAR,
+    user_id VARCHAR,
+    service VARCHAR,
+    prompt_tokens BIGINT,
+    completion_tokens BIGINT,
+    total_tokens BIGINT,
+    cost_usd DOUBLE,
+    has_pii BOOLEAN,
+    metadata JSON
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    name VARCHAR PRIMARY KEY,
+    value BIGINT NOT NULL
+);
+"""
+
+DIMENSIONS = {
+    'provider': 'provider',
+    'model': 'model',
+    'event_type': 'event_type',
+    'user_id': 'user_id',
+    'service': 'service',
+    'has_pii': 'has_pii',
+}
+
+MEASURES = {
+    'count': 'count(*)',
+    'cost': 'coalesce(sum(cost_usd), 0)',
+    'avg_cost': 'avg(cost_usd)',
+    'prompt_tokens': 'coalesce(sum(prompt_tokens), 0)',
+    'completion_tokens': 'coalesce(sum(completion_tokens), 0)',
+    'total_tokens': 'coalesce(sum(total_tokens), 0)',
+    'users': 'count(DISTINCT user_id)',
+}
+
+GRANULARITIES = ('minute', 'hour', 'day', 'week', 'month')
+
+METADATA_KEY = re.compile(r'^metadata\.([A-Za-z0-9_\-]{1,64})$')
+
+
+class AnalyticsQueryError(ValueError):
+    """Raised for invalid ad-hoc analytics queries"""
+
+
+def _naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _enum_value(value: Any) -> Any:
+    return getattr(value, 'value', value)
+
+
+def event_row(event: Dict[str, Any]) -> tuple:
+    """Flatten an ``AIUsageEvent`` dict into a mirror row"""
+    return (
+        event['id'],
+        _naive_utc(event['timestamp']),
+        _enum_value(event.get('provider')),
+        event.get('model'),
+        _enum_value(event.get('event_type')),
+        event.get('user_id'),
+        event.get('service'),
+        event.get('prompt_tokens'),
+        event.get('completion_tokens'),
+        event.get('total_tokens'),
+        event.get('cost_usd'),
+        bool(event.get('has_pii')),
+        json.dumps(event.get('metadata') or {}, default=str),
+    )
+
+
+def dimension_expression(name: str) -> str:
+    if name in DIMENSIONS:
+        return DIMENSIONS[name]
+    match = METADATA_KEY.match(name)
+    if match:
+        return f"json_extract_string(metadata, '$.{match.group(1)}')"
+    raise AnalyticsQueryError(f"Unknown dimension: {name}")
+
+
+def build_query(
+    dimensions: List[str],
+    measures: List[str],
+    filters: Dict[str, Any],
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    granularity: Optional[str],
+    order_by: Optional[str],
+    limit: int
+):
+    """Build a parameterized group-by over the events table"""
+    if not measures:
+        raise AnalyticsQueryError("At least one measure is required")
+    for measure in measures:
+        if measure not in MEASURES:
+            raise AnalyticsQueryError(f"Unknown measure: {measure}")
+    if granularity and granularity not in GRANULARITIES:
+        raise AnalyticsQueryError(f"Unknown granularity: {granularity}")
+
+    select, group_by, params = [], [], []
+    if granularity:
+        select.append(f"date_trunc('{granularity}', ts) AS bucket")
+        group_by.append('bucket')
+    for i, dimension in enumerate(dimensions):
+        select.append(f'{dimension_expression(dimension)} AS "d{i}"')
+        group_by.append(f'"d{i}"')
+    for measure in measures:
+        select.append(f'{MEASURES[measure]} AS "{measure}"')
+
+    where = []
+    for name, value in filters.items():
+        expression = dimension_expression(name)
+        if isinstance(value, list):
+            if not value:
+                continue
+            where.append(f"{expression} IN ({', '.join('?' for _ in value)})")
+            params.extend(_enum_value(v) for v in value)
+        else:
+            where.append(f"{expression} = ?")
+            params.append(_enum_value(value))
+    if start_date:
+        where.append("ts >= ?")
+        params.append(_naive_utc(start_date))
+    if end_date:
+        where.append("ts <= ?")
+        params.append(_naive_utc(end_date))
+
+    sql = f"SELECT {', '.join(select)} FROM events"
+    if where:
+        sql += f" WHERE {' AND '.join(where)}"
+    if group_by:
+        sql += f" GROUP BY {', '.join(group_by)}"
+
+    if order_by:
+        descending = order_by.startswith('-')
+        key = order_by.lstrip('-')
+        if key not in measures and not (key == 'bucket' and granularity):
+            raise AnalyticsQueryError(f"Can only order by a selected measure or bucket: {key}")
+        sql += f' ORDER BY "{key}" {"DESC" if descending else "ASC"}'
+    elif granularity:
+        sql += " ORDER BY bucket"
+    sql += f" LIMIT {int(limit)}"
+
+    columns = (['bucket'] if granularity else []) + list(dimensions) + list(measures)
+    return sql, params, columns
+
+
+class ColumnarMirror:
+    """DuckDB-backed mirror of the events collection"""
+
+    def __init__(self, path: str):
+        import duckdb
+        self.path = path
+        self.connection = duckdb.connect(path)
+        self.connection.execute(SCHEMA)
+        self._buffer: List[tuple] = []
+        self._buffer_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_requested = asyncio.Event()
+        self.rows_appended = 0
+        # Set once the startup catch-up from MongoDB has completed
+        self.synced = False
+        # Read before live ingest can append, so catch-up starts from what was mirrored last run
+        self.latest_at_open = self.latest_timestamp()
+        self.resync_version = self._load_resync_version()
+
+    def append(self, events: List[Dict[str, Any]]) -> None:
+        """Buffer freshly ingested events; flushed in the background"""
+        rows = [event_row(event) for event in events]
+        with self._buffer_lock:
+            self._buffer.extend(rows)
+            should_flush = len(self._buffer) >= ANALYTICS_FLUSH_ROWS
+        if should_flush:
+            # Writing is left to the flush loop's thread; this runs on the event loop
+            self._flush_requested.set()
+
+    def flush(self) -> int:
+        with self._buffer_lock:
+            rows, self._buffer = self._buffer, []
+        return self.write_rows(rows)
+
+    def write_rows(self, rows: List[tuple]) -> int:
+        if not rows:
+            return 0
+        import pandas as pd
+        frame = pd.DataFrame.from_records(rows, columns=COLUMNS)
+        with self._write_lock:
+            cursor = self.connection.cursor()
+            try:
+                cursor.register('incoming', frame)
+                cursor.execute(f"INSERT OR IGNORE INTO events SELECT {', '.join(COLUMNS)} FROM incoming")
+                cursor.unregister('incoming')
+            finally:
+                cursor.close()
+        self.rows_appended += len(rows)
+        return len(rows)
+
+    def latest_timestamp(self) -> Optional[datetime]:
+        cursor = self.connection.cursor()
+        try:
+            return cursor.execute("SELECT max(ts) FROM events").fetchone()[0]
+        finally:
+            cursor.close()
+
+    def _load_resync_version(self) -> int:
+        cursor = self.connection.cursor()
+        try:
+            row = cursor.execute("SELECT value FROM sync_state WHERE name = 'resync_version'").fetchone()
+        finally:
+            cursor.close()
+        return row[0] if row else 0
+
+    def save_resync_version(self, version: int) -> None:
+        """Record the last resync request applied to this mirror"""
+        with self._write_lock:
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute("INSERT OR REPLACE INTO sync_state VALUES ('resync_version', ?)", [version])
+            finally:
+                cursor.close()
+        self.resync_version = version
+
+    def row_count(self) -> int:
+        cursor = self.connection.cursor()
+        try:
+            return cursor.execute("SELECT count(*) FROM events").fetchone()[0]
+        finally:
+            cursor.close()
+
+    def query(self, sql: str, params: List[Any], columns: List[str]) -> List[Dict[str, Any]]:
+        cursor = self.connection.cursor()
+        try:
+            rows = cursor.execute(sql, params).fetchall()
+        finally:
+            cursor.close()
+        return [dict(zip(columns, row)) for row in rows]
+
+    async def run_flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), ANALYTICS_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logging.error(f"Analytics mirror flush failed: {e}")
+
+    async def sync_from(self, documents, decode, batch_size: int = 10000) -> int:
+        """Catch up from an async iterator of stored event documents"""
+        synced = 0
+        rows: List[tuple] = []
+        async for doc in documents:
+            rows.append(event_row(decode(doc)))
+            if len(rows) >= batch_size:
+                synced += await asyncio.to_thread(self.write_rows, rows)
+                rows = []
+        if rows:
+            synced += await asyncio.to_thread(self.write_rows, rows)
+        return synced
+
+    def start(self) -> None:
+        self._flush_task = asyncio.create_task(self.run_flush_loop())
+
+    async def close(self) -> None:
+        if self._flush_task:
+            self._flush_task.cancel()
+        await asyncio.to_thread(self.flush)
+        self.connection.close()
+
+
+def create_mirror() -> Optional[ColumnarMirror]:
+    """Create the mirror if the engine is enabled and DuckDB is installed"""
+    if not ANALYTICS_ENGINE_ENABLED:
+        return None
+    try:
+        return ColumnarMirror(ANALYTICS_DB_PATH)
+    except ImportError:
+        logging.warning("Analytics engine disabled: duckdb is not installed")
+        return None
+    except Exception as e:
+        logging.warning(f"Analytics engine not initialized: {e}")
+        return None
+
+
+def sync_start_time(latest: Optional[datetime]) -> Optional[datetime]:
+    """Timestamp to resume catch-up from; None means a full backfill"""
+    if latest is None:
+        return None
+    return latest - timedelta(hours=ANALYTICS_SYNC_LOOKBACK_HOURS)
+
+
+def resync_start_time(
+    latest: Optional[datetime],
+    synced: bool,
+    backfilled_since: Optional[datetime]
+) -> Optional[datetime]:
+    """Where the next catch-up starts; None means a full backfill"""
+    if synced:
+        return backfilled_since
+    start = sync_start_time(latest)
+    if start is None or backfilled_since is None:
+        return start
+    return min(_naive_utc(start), _naive_utc(backfilled_since))
+
+
+def request_resync(db, since: datetime) -> None:
+    """Ask API servers to re-mirror events from ``since`` (sync pymongo database)"""
+    counter = db[SYNC_COLLECTION].find_one_and_update(
+        {'_id': MIRROR_SYNC_ID},
+        {'$inc': {'version': 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    version = counter['version']
+    db[SYNC_COLLECTION].insert_one({
+        '_id': f"{MIRROR_SYNC_ID}:{version}",
+        'kind': MIRROR_SYNC_ID,
+        'version': version,
+        'backfilled_since': since,
+        'requested_at': datetime.now(timezone.utc),
+    })
+
+
+def pending_resync_query(applied_version: int) -> Dict[str, Any]:
+    """Resync requests a mirror that applied ``applied_version`` has yet to apply"""
+    return {'kind': MIRROR_SYNC_ID, 'version': {'$gt': applied_version}}
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - started) * 1000
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Benchmark payload size and server CPU for the read endpoint encodings.
+
+    python bench_response_encoding.py [--events 1000] [--repeat 20]
+
+Builds synthetic events with the same enrichment as the API and encodes them
+the way GET /api/v1/ai-usage/events does for each Accept / Accept-Encoding
+combination. CPU time is process time per response, including compression.
+"""
+import argparse
+import gzip
+import random
+import time
+
+from response_encoding import ARROW_AVAILABLE, iter_json, iter_msgpack, iter_arrow, msgpack
+from server import AIProvider, AIUsageEventCreate, EventType, enrich_usage_event
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+
+def make_events(count: int):
+    models = {
+        AIProvider.OPENAI: ["gpt-4", "gpt-3.5-turbo", "gpt-4-turbo"],
+        AIProvider.ANTHROPIC: ["claude-3-opus", "claude-3-sonnet", "claude-instant"],
+        AIProvider.GOOGLE: ["gemini-pro", "gemini-pro-vision", "palm-2"]
+    }
+    services = ["web-app", "api-service", "chatbot", "content-generator", "analytics"]
+    events = []
+    for i in range(count):
+        provider = random.choice(list(models))
+        model = random.choice(models[provider])
+        service = random.choice(services)
+        prompt_tokens = random.randint(10, 2000)
+        completion_tokens = random.randint(5, 1000)
+        event, _ = enrich_usage_event(AIUsageEventCreate(
+            provider=provider,
+            model=model,
+            event_type=EventType.TEXT_GENERATION,
+            user_id=f"user-{random.randint(1, 50):03d}",
+            service=service,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+            prompt=f"Sample prompt {i} for {service} using {model}, contact me at user{i}@example.com",
+            response=f"Sample response from {model}",
+            metadata={"demo": True, "request": i}
+        ))
+        events.append(event)
+    return events
+
+
+def compressors():
+    yield 'identity', None
+    yield 'gzip', lambda data: gzip.compress(data, compresslevel=9)
+    if brotli is not None:
+        # Same quality as the brotli middleware default
+        yield 'br', lambda data: brotli.compress(data, quality=4)
+
+
+def encoders():
+    yield 'application/json', iter_json
+    if msgpack is not None:
+        yield 'application/msgpack', iter_msgpack
+    if ARROW_AVAILABLE:
+        yield 'application/vnd.apache.arrow.stream', iter_arrow
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    events = make_events(args.events)
+    baseline = None
+    print(f"{args.events} events, {args.repeat} runs each\n")
+    print(f"{'encoding':40} {'compression':12} {'bytes':>10} {'ratio':>7} {'cpu ms':>8}")
+    for media_type, encode in encoders():
+        for name, compress in compressors():
+            started = time.process_time()
+            for _ in range(args.repeat):
+                body = b''.join(encode(events))
+                if compress:
+                    body = compress(body)
+            cpu_ms = (time.process_time() - started) * 1000 / args.repeat
+            baseline = baseline or len(body)
+            print(f"{media_type:40} {name:12} {len(body):>10} {len(body) / baseline:>7.2f} {cpu_ms:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Benchmark per-event enrichment CPU with and without server-side token counting.
+
+    python bench_token_counting.py [--events 5000] [--batch 100] [--templates 50]
+
+Enriches synthetic events the way the batch endpoint does, once with
+client-reported token counts and once with counts left for the server.
+Prompts are drawn from a pool of templates with a unique suffix, and
+responses repeat, so both encoding and the count memo are exercised.
+"""
+import argparse
+import random
+import time
+
+from server import AIUsageEventCreate, enrich_usage_events
+from token_counting import ENCODING_URLS, tokenizer_name, warm_tokenizers
+
+WORDS = "the model should summarize this quarterly report and list open action items for the team".split()
+MODELS = [("openai", "gpt-4o"), ("openai", "gpt-4"), ("anthropic", "claude-3-sonnet"), ("google", "gemini-pro")]
+
+
+def make_events(count: int, templates, with_counts: bool):
+    events = []
+    for i in range(count):
+        provider, model = random.choice(MODELS)
+        events.append(AIUsageEventCreate(
+            provider=provider,
+            model=model,
+            event_type="text_generation",
+            user_id=f"user-{random.randint(1, 50):03d}",
+            service="bench",
+            prompt=f"{random.choice(templates)} (request {i})",
+            response=random.choice(templates),
+            prompt_tokens=random.randint(10, 2000) if with_counts else None,
+            completion_tokens=random.randint(5, 1000) if with_counts else None
+        ))
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--templates', type=int, default=50)
+    args = parser.parse_args()
+
+    templates = [" ".join(random.choices(WORDS, k=random.randint(50, 400))) for _ in range(args.templates)]
+    warm_tokenizers()
+    print(", ".join(f"{name}: {tokenizer_name(name)}" for name in ENCODING_URLS))
+    print(f"{args.events} events in batches of {args.batch}\n")
+    baseline = None
+    for label, with_counts in (("client-reported counts", True), ("server-side counting", False)):
+        events = make_events(args.events, templates, with_counts)
+        started = time.process_time()
+        for start in range(0, len(events), args.batch):
+            enrich_usage_events(events[start:start + args.batch])
+        cpu_us = (time.process_time() - started) * 1e6 / args.events
+        baseline = baseline or cpu_us
+        print(f"{label:24} {cpu_us:>8.1f} us/event {cpu_us / baseline:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
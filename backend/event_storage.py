@@ -0,0 +1,168 @@
+"""Storage encoding for AI usage event documents.
+
+The API always works with plain ``AIUsageEvent`` dicts. When compact storage is
+enabled (``COMPACT_STORAGE=true``) documents are written with short keys,
+small-integer enum codes, without a derivable ``total_tokens`` and with the
+redacted prompt optionally compressed or offloaded to a side collection.
+``decode_event`` detects the format per document, but filters and aggregations
+use the field names of the configured encoding only, so legacy documents are
+invisible to them once the flag is on. Migrate the whole collection first
+(``migrate_compact_storage.py``), then switch the flag and the collection
+together.
+"""
+import os
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import Binary
+
+COMPACT_STORAGE = os.environ.get('COMPACT_STORAGE', 'false').lower() in ('1', 'true', 'yes')
+
+# inline | compress | offload
+PROMPT_STORAGE = os.environ.get('COMPACT_PROMPT_STORAGE', 'inline').lower()
+PROMPT_COMPRESS_MIN_BYTES = int(os.environ.get('COMPACT_PROMPT_COMPRESS_MIN_BYTES', '256'))
+PROMPTS_COLLECTION = 'ai_usage_prompts'
+
+FIELD_KEYS = {
+    'id': '_id',
+    'timestamp': 'ts',
+    'provider': 'p',
+    'model': 'm',
+    'event_type': 'et',
+    'user_id': 'u',
+    'service': 's',
+    'prompt_tokens': 'pt',
+    'completion_tokens': 'ct',
+    'total_tokens': 'tt',
+    'cost_usd': 'c',
+    'prompt_hash': 'ph',
+    'response_hash': 'rh',
+    'metadata': 'md',
+    'has_pii': 'pii',
+    'redacted_prompt': 'rp',
+    's3_key': 's3',
+}
+FIELD_NAMES = {key: name for name, key in FIELD_KEYS.items()}
+
+COMPRESSED_PROMPT_KEY = 'rpz'
+OFFLOADED_PROMPT_KEY = 'rpo'
+
+# Codes are persisted; only ever append new values
+ENUM_CODES = {
+    'provider': {'other': 0, 'openai': 1, 'anthropic': 2, 'google': 3, 'cohere': 4},
+    'event_type': {'other': 0, 'text_generation': 1, 'image_generation': 2, 'embedding': 3, 'fine_tuning': 4},
+}
+ENUM_VALUES = {name: {code: value for value, code in codes.items()} for name, codes in ENUM_CODES.items()}
+
+
+def storage_field(name: str, compact: Optional[bool] = None) -> str:
+    """Return the stored key for an ``AIUsageEvent`` field"""
+    compact = COMPACT_STORAGE if compact is None else compact
+    return FIELD_KEYS.get(name, name) if compact else name
+
+
+def encode_value(name: str, value: Any, compact: Optional[bool] = None) -> Any:
+    """Encode a single field value (e.g. a query operand) for storage"""
+    compact = COMPACT_STORAGE if compact is None else compact
+    if compact and name in ENUM_CODES and value is not None:
+        return ENUM_CODES[name][getattr(value, 'value', value)]
+    if hasattr(value, 'value'):
+        return value.value
+    return value
+
+
+def decode_value(name: str, value: Any) -> Any:
+    """Decode a stored field value; plain strings pass through unchanged"""
+    if name in ENUM_VALUES and isinstance(value, int):
+        return ENUM_VALUES[name].get(value, 'other')
+    return value
+
+
+def translate_query(query: Dict[str, Any], compact: Optional[bool] = None) -> Dict[str, Any]:
+    """Translate a query written against ``AIUsageEvent`` field names"""
+    translated = {}
+    for name, condition in query.items():
+        if isinstance(condition, dict):
+            condition = {op: encode_value(name, operand, compact) for op, operand in condition.items()}
+        else:
+            condition = encode_value(name, condition, compact)
+        translated[storage_field(name, compact)] = condition
+    return translated
+
+
+def encode_event(
+    event: Dict[str, Any],
+    compact: Optional[bool] = None,
+    prompt_storage: Optional[str] = None
+) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """Encode an event dict into a stored document.
+
+    Returns the document and, when the prompt is offloaded, the document to
+    write to the prompts collection.
+    """
+    compact = COMPACT_STORAGE if compact is None else compact
+    if not compact:
+        return dict(event), None
+
+    prompt_storage = prompt_storage or PROMPT_STORAGE
+    doc: Dict[str, Any] = {}
+    for name, value in event.items():
+        if value is None or (name == 'metadata' and not value) or (name == 'has_pii' and not value):
+            continue
+        if name == 'redacted_prompt':
+            continue
+        doc[FIELD_KEYS.get(name, name)] = encode_value(name, value, compact=True)
+
+    # total_tokens is only stored when it can't be derived from its parts
+    prompt_tokens = event.get('prompt_tokens')
+    completion_tokens = event.get('completion_tokens')
+    if prompt_tokens is not None and completion_tokens is not None:
+        if event.get('total_tokens') == prompt_tokens + completion_tokens:
+            doc.pop(FIELD_KEYS['total_tokens'], None)
+        elif event.get('total_tokens') is None:
+            doc[FIELD_KEYS['total_tokens']] = None
+
+    offloaded = None
+    prompt = event.get('redacted_prompt')
+    if prompt:
+        if prompt_storage == 'offload':
+            doc[OFFLOADED_PROMPT_KEY] = True
+            offloaded = {'_id': event['id'], FIELD_KEYS['redacted_prompt']: prompt}
+        elif prompt_storage == 'compress' and len(prompt.encode()) >= PROMPT_COMPRESS_MIN_BYTES:
+            doc[COMPRESSED_PROMPT_KEY] = Binary(zlib.compress(prompt.encode()))
+        else:
+            doc[FIELD_KEYS['redacted_prompt']] = prompt
+    return doc, offloaded
+
+
+def is_compact(doc: Dict[str, Any]) -> bool:
+    return FIELD_KEYS['timestamp'] in doc and 'timestamp' not in doc
+
+
+def decode_event(doc: Dict[str, Any], prompts: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Decode a stored document (legacy or compact) into an ``AIUsageEvent`` dict"""
+    if not is_compact(doc):
+        event = dict(doc)
+        event.pop('_id', None)
+        return event
+
+    event: Dict[str, Any] = {}
+    for key, value in doc.items():
+        if key in (COMPRESSED_PROMPT_KEY, OFFLOADED_PROMPT_KEY):
+            continue
+        name = FIELD_NAMES.get(key, key)
+        event[name] = decode_value(name, value)
+
+    if FIELD_KEYS['total_tokens'] not in doc and event.get('prompt_tokens') is not None \
+            and event.get('completion_tokens') is not None:
+        event['total_tokens'] = event['prompt_tokens'] + event['completion_tokens']
+    if COMPRESSED_PROMPT_KEY in doc:
+        event['redacted_prompt'] = zlib.decompress(bytes(doc[COMPRESSED_PROMPT_KEY])).decode()
+    elif doc.get(OFFLOADED_PROMPT_KEY) and prompts is not None:
+        event['redacted_prompt'] = prompts.get(event['id'])
+    return event
+
+
+def offloaded_ids(docs: List[Dict[str, Any]]) -> List[str]:
+    """Ids of documents whose redacted prompt lives in the prompts collection"""
+    return [doc['_id'] for doc in docs if doc.get(OFFLOADED_PROMPT_KEY)]
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""Bulk import AI usage events from JSONL (optionally gzip-compressed) files.
+
+    python import_events.py usage-2025-01.jsonl.gz [--workers 8] [--chunk-size 2000]
+
+Each line is an ``AIUsageEventCreate`` payload, optionally with an ISO-8601
+``timestamp`` for backfills. Lines are parsed and enriched (PII redaction,
+hashing, token counting, cost estimation) in worker processes with the same
+logic as the API, then written with unordered bulk writes from a pool of
+writer threads. Progress is checkpointed after each contiguous chunk so an
+interrupted import resumes where it stopped.
+
+Lines without an ``id`` get one derived from the source, the line's byte offset
+and its content, so lines written again after a resume or a repeated import are
+deduplicated by the unique index like client-supplied ids. The source is a hash
+of the first 64 KiB of the (decompressed) file, so ids survive moving,
+renaming or re-compressing it. A file that is still being appended to changes
+its source while it is shorter than that; its checkpoint keeps the original
+source, but to re-import it from scratch pass the same ``--source-id`` every
+time.
+
+Running API servers are asked to re-mirror the imported time range into their
+analytics mirror. Full prompts are not uploaded to S3 by this tool.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from pymongo import InsertOne, MongoClient
+from pymongo.errors import BulkWriteError
+
+from analytics_engine import request_resync
+from event_storage import COMPACT_STORAGE, PROMPTS_COLLECTION, encode_event, storage_field
+from server import AIUsageEventCreate, DUPLICATE_KEY_ERROR_CODE, enrich_usage_events
+
+IMPORT_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'ai-usage/import_events')
+SOURCE_HEADER_BYTES = 64 * 1024
+
+
+def open_input(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def source_identity(path: str, length: int = SOURCE_HEADER_BYTES) -> Tuple[str, int]:
+    """Hash of the first ``length`` decompressed bytes and how many there were"""
+    with open_input(path) as f:
+        header = f.read(length)
+    return hashlib.sha256(header).hexdigest(), len(header)
+
+
+def read_chunks(path: str, offset: int, chunk_size: int) -> Iterator[Tuple[int, List[Tuple[int, bytes]]]]:
+    """Yield (end byte offset, [(line offset, line)]) chunks starting at a byte offset"""
+    with open_input(path) as f:
+        if offset:
+            f.seek(offset)
+        lines: List[Tuple[int, bytes]] = []
+        for line in f:
+            if line.strip():
+                lines.append((offset, line))
+            offset += len(line)
+            if len(lines) >= chunk_size:
+                yield offset, lines
+                lines = []
+        if lines:
+            yield offset, lines
+
+
+def parse_timestamp(value: Any) -> datetime:
+    timestamp = datetime.fromisoformat(value.replace('Z', '+00:00')) if isinstance(value, str) else None
+    if timestamp is None:
+        raise ValueError(f"invalid timestamp: {value!r}")
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def line_id(source: str, offset: int, line: bytes) -> str:
+    """Stable id for a line without one, so re-imported lines are duplicates"""
+    content = hashlib.sha256(line.strip()).hexdigest()
+    return str(uuid.uuid5(IMPORT_ID_NAMESPACE, f"{source}:{offset}:{content}"))
+
+
+def enrich_chunk(source: str, lines: List[Tuple[int, bytes]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[str]]:
+    """Parse, validate and enrich a chunk of lines (runs in a worker process)"""
+    documents, prompts, rejects = [], [], []
+    valid, timestamps = [], []
+    for offset, line in lines:
+        try:
+            payload = json.loads(line)
+            timestamp = payload.pop('timestamp', None)
+            if payload.get('id') is None:
+                payload['id'] = line_id(source, offset, line)
+            event_data = AIUsageEventCreate(**payload)
+            if timestamp is not None:
+                timestamp = parse_timestamp(timestamp)
+        except ValidationError as e:
+            error = e.errors()[0]
+            rejects.append(f"{'.'.join(map(str, error['loc']))}: {error['msg']}\t{line.decode(errors='replace').strip()}")
+            continue
+        except (ValueError, TypeError, AttributeError) as e:
+            rejects.append(f"{e}\t{line.decode(errors='replace').strip()}")
+            continue
+        valid.append(event_data)
+        timestamps.append(timestamp)
+    
+    # Enrich the chunk at once so missing token counts are encoded in one batch
+    for (event, _), timestamp in zip(enrich_usage_events(valid), timestamps):
+        if timestamp is not None:
+            event.timestamp = timestamp
+        document, prompt = encode_event(event.dict())
+        documents.append(document)
+        if prompt:
+            prompts.append(prompt)
+    return documents, prompts, rejects
+
+
+def write_chunk(db, collection: str, documents: List[Dict[str, Any]], prompts: List[Dict[str, Any]]) -> Tuple[int, int, int]:
+    """Unordered bulk write of one chunk; returns (inserted, duplicates, prompts not offloaded)"""
+    if not documents:
+        return 0, 0, 0
+    try:
+        result = db[collection].bulk_write([InsertOne(doc) for doc in documents], ordered=False)
+        inserted, duplicates = result.inserted_count, 0
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        other = [error for error in errors if error.get('code') != DUPLICATE_KEY_ERROR_CODE]
+        if other:
+            raise
+        inserted, duplicates = e.details.get('nInserted', 0), len(errors)
+    lost_prompts = 0
+    if prompts:
+        try:
+            db[PROMPTS_COLLECTION].bulk_write([InsertOne(prompt) for prompt in prompts], ordered=False)
+        except BulkWriteError as e:
+            # A duplicate means the prompt was stored by an earlier run
+            lost = [error for error in e.details.get('writeErrors', []) if error.get('code') != DUPLICATE_KEY_ERROR_CODE]
+            if lost:
+                lost_prompts = len(lost)
+                print(f"\n  failed to offload {lost_prompts} prompts: {lost[0].get('errmsg')}", file=sys.stderr)
+    return inserted, duplicates, lost_prompts
+
+
+class Checkpoint:
+    """Byte offset and counters of the last fully written chunk"""
+
+    def __init__(self, path: str, source: str, source_bytes: Optional[int] = None):
+        self.path = path
+        self.state = {
+            'source': source, 'source_bytes': source_bytes,
+            'offset': 0, 'lines': 0, 'inserted': 0, 'duplicates': 0, 'invalid': 0, 'lost_prompts': 0,
+        }
+
+    def load(self, input_path: str) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get('source') == self.state['source'] or self._appended_to(state, input_path):
+            self.state = state
+
+    def _appended_to(self, state: Dict[str, Any], input_path: str) -> bool:
+        """Whether the input is the checkpointed file with lines added since"""
+        saved_bytes, current_bytes = state.get('source_bytes'), self.state['source_bytes']
+        if not saved_bytes or current_bytes is None or saved_bytes >= current_bytes:
+            return False
+        return source_identity(input_path, saved_bytes)[0] == state['source']
+
+    def save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+
+def import_file(db, path: str, args) -> Dict[str, Any]:
+    if args.source_id:
+        checkpoint = Checkpoint(args.checkpoint or f"{path}.checkpoint", args.source_id)
+    else:
+        checkpoint = Checkpoint(args.checkpoint or f"{path}.checkpoint", *source_identity(path))
+    if not args.restart:
+        checkpoint.load(path)
+    state = checkpoint.state
+    if state['offset']:
+        print(f"Resuming {path} at line {state['lines']} (byte {state['offset']})", file=sys.stderr)
+
+    rejects = open(args.rejects, 'a') if args.rejects else None
+    ts_field = storage_field("timestamp")
+    earliest = None  # oldest timestamp written, for the analytics mirror resync
+    started = time.monotonic()
+    start_lines = state['lines']
+    max_in_flight = args.workers * 2
+
+    def report():
+        elapsed = max(time.monotonic() - started, 1e-6)
+        rate = (state['lines'] - start_lines) / elapsed
+        print(
+            f"\r  {state['lines']} lines  {rate:,.0f}/s  inserted {state['inserted']}  "
+            f"duplicates {state['duplicates']}  invalid {state['invalid']}",
+            end='', file=sys.stderr
+        )
+
+    with ProcessPoolExecutor(max_workers=args.workers) as enrichers, \
+            ThreadPoolExecutor(max_workers=args.writers) as writers:
+        enriching = deque()
+        writing = deque()
+
+        def collect_enriched(wait: bool) -> None:
+            nonlocal earliest
+            # Hand finished enrichment to the writers in input order
+            while enriching and (wait or enriching[0][2].done()):
+                end_offset, line_count, future = enriching.popleft()
+                documents, prompts, chunk_rejects = future.result()
+                if documents:
+                    oldest = min(doc[ts_field] for doc in documents)
+                    earliest = oldest if earliest is None else min(earliest, oldest)
+                if rejects:
+                    rejects.writelines(f"{reject}\n" for reject in chunk_rejects)
+                write = writers.submit(write_chunk, db, args.collection, documents, prompts)
+                writing.append((end_offset, line_count, len(chunk_rejects), write))
+                wait = False
+
+        def collect_written(wait: bool) -> None:
+            # Advance the checkpoint over contiguous written chunks
+            while writing and (wait or writing[0][3].done()):
+                end_offset, line_count, invalid, write = writing.popleft()
+                inserted, duplicates, lost_prompts = write.result()
+                state['offset'] = end_offset
+                state['lines'] += line_count
+                state['inserted'] += inserted
+                state['duplicates'] += duplicates
+                state['invalid'] += invalid
+                state['lost_prompts'] = state.get('lost_prompts', 0) + lost_prompts
+                checkpoint.save()
+                report()
+                wait = False
+
+        try:
+            for end_offset, lines in read_chunks(path, state['offset'], args.chunk_size):
+                enriching.append((end_offset, len(lines), enrichers.submit(enrich_chunk, state['source'], lines)))
+                collect_enriched(wait=len(enriching) >= max_in_flight)
+                collect_written(wait=len(writing) >= max_in_flight)
+            while enriching:
+                collect_enriched(wait=True)
+            while writing:
+                collect_written(wait=True)
+        finally:
+            # Imported events bypass the API, so running servers re-mirror the imported range
+            if earliest is not None and args.collection == 'ai_usage_events':
+                request_resync(db, earliest)
+
+    if rejects:
+        rejects.close()
+    report()
+    print(file=sys.stderr)
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help="JSONL or JSONL.gz files")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="enrichment processes")
+    parser.add_argument('--writers', type=int, default=4, help="concurrent bulk writers")
+    parser.add_argument('--chunk-size', type=int, default=2000, help="lines per bulk write")
+    parser.add_argument('--collection', default='ai_usage_events')
+    parser.add_argument('--checkpoint', help="checkpoint file (default: <path>.checkpoint)")
+    parser.add_argument('--rejects', help="append rejected lines with their error to this file")
+    parser.add_argument('--restart', action='store_true', help="ignore an existing checkpoint")
+    parser.add_argument('--source-id', help="identifies the input when deriving ids for lines without one "
+                                            "(default: hash of the first 64 KiB)")
+    args = parser.parse_args()
+    if args.checkpoint and len(args.paths) > 1:
+        parser.error("--checkpoint can only be used with a single input file")
+    if args.source_id and len(args.paths) > 1:
+        parser.error("--source-id can only be used with a single input file")
+
+    client = MongoClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    if not COMPACT_STORAGE:
+        db[args.collection].create_index("id", unique=True)
+    db[args.collection].create_index([(storage_field("timestamp"), -1)])
+
+    for path in args.paths:
+        state = import_file(db, path, args)
+        print(
+            f"{path}: {state['lines']} lines, {state['inserted']} inserted, "
+            f"{state['duplicates']} duplicates, {state['invalid']} invalid"
+            + (f", {state['lost_prompts']} prompts not offloaded" if state.get('lost_prompts') else "")
+        )
+    client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
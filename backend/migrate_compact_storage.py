@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Migrate ai_usage_events to the compact storage encoding and compare sizes.
+
+    python migrate_compact_storage.py report [--sample 1000] [--prompt-storage compress]
+    python migrate_compact_storage.py migrate --target ai_usage_events_compact [--prompt-storage offload]
+
+``migrate`` copies every document into the target collection in compact form
+(it is safe to re-run: already copied events are skipped as duplicates). Once
+it completes, swap the collections and start the API with
+``COMPACT_STORAGE=true`` and the same ``COMPACT_PROMPT_STORAGE``.
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import bson
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+
+from event_storage import PROMPTS_COLLECTION, encode_event, decode_event
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+
+def get_db():
+    client = MongoClient(os.environ['MONGO_URL'])
+    return client[os.environ['DB_NAME']]
+
+
+def collection_stats(db, name):
+    """Return (count, size, storageSize, totalIndexSize) for a collection"""
+    if name not in db.list_collection_names():
+        return None
+    stats = db.command('collStats', name)
+    return stats['count'], stats['size'], stats['storageSize'], stats['totalIndexSize']
+
+
+def encoded_size(docs, prompt_storage):
+    """BSON bytes for docs in the legacy and compact encodings"""
+    legacy = compact = 0
+    for doc in docs:
+        event = decode_event(doc)
+        legacy_doc, _ = encode_event(event, compact=False)
+        compact_doc, prompt = encode_event(event, compact=True, prompt_storage=prompt_storage)
+        legacy += len(bson.encode(legacy_doc)) + len(bson.encode({'_id': bson.ObjectId()}))
+        compact += len(bson.encode(compact_doc))
+        if prompt:
+            compact += len(bson.encode(prompt))
+    return legacy, compact
+
+
+def report(db, args):
+    docs = list(db[args.source].aggregate([{'$sample': {'size': args.sample}}]))
+    if not docs:
+        print(f"No documents in {args.source}")
+        return 0
+
+    legacy, compact = encoded_size(docs, args.prompt_storage)
+    print(f"Sample of {len(docs)} events from {args.source} (prompt storage: {args.prompt_storage})")
+    print(f"  legacy  avg document: {legacy / len(docs):8.1f} bytes")
+    print(f"  compact avg document: {compact / len(docs):8.1f} bytes")
+    print(f"  reduction:            {100 * (1 - compact / legacy):8.1f} %")
+
+    print("\nCollection stats (count, size, storageSize, indexSize):")
+    for name in (args.source, args.target, PROMPTS_COLLECTION):
+        stats = collection_stats(db, name)
+        print(f"  {name:28} {stats if stats else 'missing'}")
+    return 0
+
+
+def migrate(db, args):
+    source, target = db[args.source], db[args.target]
+    migrated = duplicates = lost_prompts = 0
+    batch = []
+
+    def flush():
+        nonlocal migrated, duplicates, lost_prompts
+        if not batch:
+            return
+        docs = [doc for doc, _ in batch]
+        failed = set()
+        try:
+            target.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                if error.get('code') != DUPLICATE_KEY_ERROR_CODE:
+                    raise
+                failed.add(error['index'])
+        # Prompts of already copied events are offloaded too, so a re-run fills in any an earlier run lost
+        prompts = [prompt for _, prompt in batch if prompt]
+        if prompts:
+            try:
+                db[PROMPTS_COLLECTION].insert_many(prompts, ordered=False)
+            except BulkWriteError as e:
+                # A duplicate means the prompt was copied by an earlier run
+                lost = [error for error in e.details.get('writeErrors', []) if error.get('code') != DUPLICATE_KEY_ERROR_CODE]
+                if lost:
+                    lost_prompts += len(lost)
+                    print(f"\n  failed to offload {len(lost)} prompts: {lost[0].get('errmsg')}", file=sys.stderr)
+        migrated += len(docs) - len(failed)
+        duplicates += len(failed)
+        batch.clear()
+        print(f"\r  migrated {migrated}, skipped {duplicates}", end='', file=sys.stderr)
+
+    for doc in source.find({}, batch_size=args.batch_size):
+        batch.append(encode_event(decode_event(doc), compact=True, prompt_storage=args.prompt_storage))
+        if len(batch) >= args.batch_size:
+            flush()
+    flush()
+    print(file=sys.stderr)
+
+    db[args.target].create_index([('ts', -1)])
+    print(f"Migrated {migrated} events to {args.target} ({duplicates} already present)")
+    if lost_prompts:
+        print(f"Failed to offload {lost_prompts} prompts to {PROMPTS_COLLECTION}; re-run to retry them")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['report', 'migrate'])
+    parser.add_argument('--source', default='ai_usage_events')
+    parser.add_argument('--target', default='ai_usage_events_compact')
+    parser.add_argument('--prompt-storage', choices=['inline', 'compress', 'offload'], default='compress')
+    parser.add_argument('--sample', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    db = get_db()
+    if args.command == 'report':
+        return report(db, args)
+    return migrate(db, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
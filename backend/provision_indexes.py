@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""Create the MongoDB indexes the API relies on, then exit.
+
+    python provision_indexes.py
+
+Long-running servers create them at startup. With ``LAZY_INIT=true``
+(serverless) nothing does, so run this once per database as a deploy step:
+without the unique ``id`` index client-supplied event ids are not
+deduplicated, and without the text index prompt search (``q=``) fails.
+Uses the same ``MONGO_URL``, ``DB_NAME`` and storage settings as the API.
+"""
+import argparse
+import asyncio
+import sys
+
+import server
+
+
+async def provision() -> int:
+    try:
+        await server.ensure_indexes()
+        names = await server.db.ai_usage_events.index_information()
+        print(f"ai_usage_events indexes: {', '.join(sorted(names))}")
+    finally:
+        if server.client:
+            server.client.close()
+    return 0
+
+
+def main():
+    argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter).parse_args()
+    return asyncio.run(provision())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""Content negotiation for bulk read endpoints.
+
+JSON stays the default. Programmatic clients can ask for MessagePack
+(``Accept: application/msgpack``) or Arrow IPC
+(``Accept: application/vnd.apache.arrow.stream``) when the optional
+``msgpack`` / ``pyarrow`` packages are installed. Rows are encoded a chunk
+at a time. Once the encoded body reaches RESPONSE_COMPRESSION_MIN_BYTES the
+rest is streamed, so a large body is never held fully encoded; smaller bodies
+are sent whole so the compression middleware can skip them.
+"""
+import importlib.util
+import io
+import itertools
+import json
+import os
+from enum import Enum
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+# pyarrow is large, so it is only imported when an Arrow response is requested
+ARROW_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+ARROW = 'application/vnd.apache.arrow.stream'
+
+MSGPACK_ALIASES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+
+ENCODE_CHUNK_ROWS = 500
+# Bodies below this size are neither compressed nor streamed
+COMPRESSION_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+
+
+def negotiate(accept: Optional[str], allow_arrow: bool = True) -> str:
+    """Pick the response media type from an Accept header (first match wins)"""
+    if not accept:
+        return JSON
+    for part in accept.split(','):
+        media_type = part.split(';')[0].strip().lower()
+        if media_type in MSGPACK_ALIASES and msgpack is not None:
+            return MSGPACK
+        if media_type == ARROW and allow_arrow and ARROW_AVAILABLE:
+            return ARROW
+        if media_type in (JSON, 'application/*', '*/*'):
+            return JSON
+    return JSON
+
+
+def _plain(item: Any) -> Dict[str, Any]:
+    return item.dict() if isinstance(item, BaseModel) else item
+
+
+def _arrow_value(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (dict, list)):
+        return json.dumps(jsonable_encoder(value))
+    return value
+
+
+def iter_json(items: List[Any]) -> Iterator[bytes]:
+    """Encode a JSON array a chunk of rows at a time"""
+    yield b'['
+    for start in range(0, len(items), ENCODE_CHUNK_ROWS):
+        chunk = jsonable_encoder(items[start:start + ENCODE_CHUNK_ROWS])
+        body = json.dumps(chunk, separators=(',', ':'))[1:-1]
+        if start and body:
+            body = ',' + body
+        yield body.encode()
+    yield b']'
+
+
+def iter_msgpack(items: List[Any]) -> Iterator[bytes]:
+    packer = msgpack.Packer()
+    yield packer.pack_array_header(len(items))
+    for start in range(0, len(items), ENCODE_CHUNK_ROWS):
+        chunk = jsonable_encoder(items[start:start + ENCODE_CHUNK_ROWS])
+        yield b''.join(packer.pack(item) for item in chunk)
+
+
+def iter_arrow(items: List[Any]) -> Iterator[bytes]:
+    """Arrow IPC stream; nested values (e.g. metadata) are sent as JSON strings"""
+    import pyarrow as pa
+    rows = [{key: _arrow_value(value) for key, value in _plain(item).items()} for item in items]
+    table = pa.Table.from_pylist(rows)
+    buffer = io.BytesIO()
+
+    def take() -> bytes:
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    with pa.ipc.new_stream(pa.PythonFile(buffer, mode='w'), table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=ENCODE_CHUNK_ROWS):
+            writer.write_batch(batch)
+            yield take()
+    yield take()
+
+
+def encoded_response(request: Request, items: List[Any]) -> Response:
+    """Encode a list of rows in the media type negotiated from the request"""
+    media_type = negotiate(request.headers.get('accept'))
+    if media_type == MSGPACK:
+        body: Iterable[bytes] = iter_msgpack(items)
+    elif media_type == ARROW:
+        body = iter_arrow(items)
+    else:
+        body = iter_json(items)
+    headers = {'Vary': 'Accept'}
+    head: List[bytes] = []
+    size = 0
+    for part in body:
+        head.append(part)
+        size += len(part)
+        if size >= COMPRESSION_MIN_BYTES:
+            # Starlette encodes the remaining chunks in its thread pool as they are sent
+            return StreamingResponse(itertools.chain(head, body), media_type=media_type, headers=headers)
+    return Response(b''.join(head), media_type=media_type, headers=headers)
+
+
+def encoded_object_response(request: Request, payload: Any) -> Response:
+    """Encode a single object; Arrow is tabular only, so it falls back to JSON"""
+    media_type = negotiate(request.headers.get('accept'), allow_arrow=False)
+    content = jsonable_encoder(payload)
+    if media_type == MSGPACK:
+        return Response(msgpack.packb(content), media_type=MSGPACK, headers={'Vary': 'Accept'})
+    return Response(json.dumps(content, separators=(',', ':')), media_type=JSON, headers={'Vary': 'Accept'})
@@ -1,29 +1,70 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Depends, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.middleware.gzip import GZipMiddleware
+from pymongo.errors import BulkWriteError, DuplicateKeyError, ConnectionFailure, ExecutionTimeout, WTimeoutError
 import os
+import asyncio
 import logging
 import json
 import hashlib
 import re
 from pathlib import Path
-from pydantic import BaseModel, Field, validator
-from typing import List, Optional, Dict, Any, Union
+from pydantic import BaseModel, Field, validator, ValidationError
+from typing import List, Optional, Dict, Any, Union, Tuple
 import uuid
 from datetime import datetime, timezone, timedelta
 from enum import Enum
-import boto3
-from botocore.exceptions import ClientError
+from event_storage import (
+    COMPACT_STORAGE, PROMPT_STORAGE, PROMPTS_COLLECTION, storage_field, decode_value,
+    translate_query, encode_event, decode_event, offloaded_ids
+)
+from analytics_engine import (
+    ANALYTICS_RESYNC_INTERVAL, MIRROR_SYNC_ID, SYNC_COLLECTION, AnalyticsQueryError,
+    build_query, create_mirror, pending_resync_query, resync_start_time, timed
+)
+from response_encoding import ARROW, COMPRESSION_MIN_BYTES, negotiate, encoded_response, encoded_object_response
+from timeseries import (
+    GRANULARITY_SECONDS, TimeSeriesError, as_utc, choose_granularity, columnar_query,
+    downsample, fill_buckets, format_points, mongo_pipeline
+)
+from admission import AdmissionController, AdmissionRejected, event_costs
+from spool import SPOOL_ON_OVERLOAD, SPOOL_REPLAY_INTERVAL, SpoolFull, create_spool
+from token_counting import count_tokens, tokenizer_family, tokenizer_name, warm_tokenizers
+from alerts import (
+    ALERTS_COLLECTION, Alert, AlertRule, AlertEvaluator, AlertDispatcher, load_rules
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# Serverless mode: skip startup work that only pays off in a long-running process
+LAZY_INIT = os.environ.get('LAZY_INIT', 'false').lower() in ('1', 'true', 'yes')
+
+# MongoDB connection (the client is created on first use)
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+client = None
+
+def get_client():
+    global client
+    if client is None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(mongo_url)
+    return client
+
+class LazyDatabase:
+    """Database handle that creates the Motor client on first access"""
+    def __init__(self, name: str):
+        self.name = name
+    
+    def __getattr__(self, collection: str):
+        return getattr(get_client()[self.name], collection)
+    
+    def __getitem__(self, collection: str):
+        return get_client()[self.name][collection]
+
+db = LazyDatabase(os.environ['DB_NAME'])
 
 # Create the main app without a prefix
 app = FastAPI(title="Night's Watch AI Usage Analyzer", version="1.0.0")
@@ -34,18 +75,39 @@ api_router = APIRouter(prefix="/api")
 # Security
 security = HTTPBearer()
 
-# S3 client (optional)
+# Columnar analytics mirror (optional, created at startup)
+analytics_mirror = None
+
+# Streaming alert evaluation (enabled when alert rules are configured)
+alert_evaluator = None
+alert_dispatcher = None
+
+# Per-tenant rate limits and write-pipeline concurrency cap for ingestion
+admission = AdmissionController()
+
+# Local spool for events that can't be written to MongoDB (created at startup)
+ingest_spool = None
+
+# S3 client (optional, boto3 is imported on first use)
+S3_ENABLED = bool(os.environ.get('AWS_ACCESS_KEY_ID'))
 s3_client = None
-try:
-    if os.environ.get('AWS_ACCESS_KEY_ID'):
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
-            region_name=os.environ.get('AWS_REGION', 'us-east-1')
-        )
-except Exception as e:
-    logging.warning(f"S3 client not initialized: {e}")
+s3_client_failed = False
+
+def get_s3_client():
+    global s3_client, s3_client_failed
+    if s3_client is None and S3_ENABLED and not s3_client_failed:
+        try:
+            import boto3
+            s3_client = boto3.client(
+                's3',
+                aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
+                aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
+                region_name=os.environ.get('AWS_REGION', 'us-east-1')
+            )
+        except Exception as e:
+            s3_client_failed = True
+            logging.warning(f"S3 client not initialized: {e}")
+    return s3_client
 
 # Enums
 class AIProvider(str, Enum):
@@ -67,6 +129,13 @@ class UserRole(str, Enum):
     AUDITOR = "auditor"
     DEVELOPER = "developer"
 
+class IngestStatus(str, Enum):
+    INSERTED = "inserted"
+    DUPLICATE = "duplicate"
+    INVALID = "invalid"
+    FAILED = "failed"
+    SPOOLED = "spooled"
+
 # Models
 class AIUsageEvent(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -88,6 +157,8 @@ class AIUsageEvent(BaseModel):
     s3_key: Optional[str] = None
 
 class AIUsageEventCreate(BaseModel):
+    # Optional client-supplied id so retried submissions are deduplicated
+    id: Optional[str] = Field(None, min_length=1, max_length=128)
     provider: AIProvider
     model: str
     event_type: EventType
@@ -102,7 +173,48 @@ class AIUsageEventCreate(BaseModel):
     metadata: Dict[str, Any] = Field(default_factory=dict)
 
 class AIUsageEventBatch(BaseModel):
-    events: List[AIUsageEventCreate]
+    # Items are validated one by one so a bad item (even a non-object) doesn't reject the batch
+    events: List[Any]
+
+class AnalyticsQuery(BaseModel):
+    dimensions: List[str] = Field(default_factory=list)
+    measures: List[str] = Field(default_factory=lambda: ["count", "cost"])
+    filters: Dict[str, Union[str, bool, List[str]]] = Field(default_factory=dict)
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    granularity: Optional[str] = None
+    order_by: Optional[str] = None
+    limit: int = Field(1000, ge=1, le=100000)
+
+class AnalyticsQueryResponse(BaseModel):
+    columns: List[str]
+    rows: List[Dict[str, Any]]
+    row_count: int
+    elapsed_ms: float
+
+class TimeSeriesResponse(BaseModel):
+    granularity: str
+    measure: str
+    start_date: datetime
+    end_date: datetime
+    source: str
+    raw_points: int
+    points: List[Dict[str, Any]]
+
+class BatchItemResult(BaseModel):
+    index: int
+    id: Optional[str] = None
+    status: IngestStatus
+    error: Optional[str] = None
+    event: Optional[AIUsageEvent] = None
+
+class BatchIngestResponse(BaseModel):
+    inserted: int
+    duplicates: int
+    invalid: int
+    failed: int
+    spooled: int = 0
+    results: List[BatchItemResult]
 
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -160,8 +272,10 @@ def calculate_hash(text: str) -> str:
 
 async def store_to_s3(content: str, key: str) -> bool:
     """Store content to S3 bucket"""
+    s3_client = get_s3_client()
     if not s3_client:
         return False
+    from botocore.exceptions import ClientError
     
     try:
         bucket = os.environ.get('S3_BUCKET_NAME')
@@ -179,15 +293,17 @@ async def store_to_s3(content: str, key: str) -> bool:
         logging.error(f"S3 upload failed: {e}")
         return False
 
-async def process_usage_event(event_data: AIUsageEventCreate) -> AIUsageEvent:
-    """Process and enhance usage event"""
+def prepare_usage_event(event_data: AIUsageEventCreate) -> Tuple[AIUsageEvent, Optional[str], Optional[str]]:
+    """Redact and hash an event; returns the event, raw prompt and raw response"""
     event_dict = event_data.dict()
     
     # Process prompt and response
     prompt = event_dict.pop('prompt', None)
     response = event_dict.pop('response', None)
     
-    # Create event object
+    # Create event object, keeping a client-supplied id when present
+    if not event_dict.get('id'):
+        event_dict.pop('id', None)
     event = AIUsageEvent(**event_dict)
     
     # PII detection and redaction
@@ -195,23 +311,241 @@ async def process_usage_event(event_data: AIUsageEventCreate) -> AIUsageEvent:
         event.has_pii = detect_pii(prompt)
         event.redacted_prompt = redact_pii(prompt) if event.has_pii else prompt
         event.prompt_hash = calculate_hash(prompt)
-        
-        # Store full prompt to S3 if configured
-        if s3_client and prompt:
-            s3_key = f"prompts/{event.id}.txt"
-            if await store_to_s3(prompt, s3_key):
-                event.s3_key = s3_key
     
     if response:
         event.response_hash = calculate_hash(response)
     
+    return event, prompt, response
+
+def fill_token_counts(prepared: List[Tuple[AIUsageEvent, Optional[str], Optional[str]]]) -> None:
+    """Count prompt and completion tokens the client didn't report, in one batch"""
+    pending = []
+    for event, prompt, response in prepared:
+        # A reported total is authoritative; counted parts could contradict it
+        if event.total_tokens is not None:
+            continue
+        family = tokenizer_family(event.provider.value, event.model)
+        if event.prompt_tokens is None and prompt:
+            pending.append((event, 'prompt_tokens', (family, event.prompt_hash, prompt)))
+        if event.completion_tokens is None and response:
+            pending.append((event, 'completion_tokens', (family, event.response_hash, response)))
+    
+    if pending:
+        counts = count_tokens([item for _, _, item in pending])
+        for (event, field, (family, _, _)), count in zip(pending, counts):
+            setattr(event, field, count)
+            event.metadata.setdefault('token_count_source', tokenizer_name(family))
+    
+    for event, _, _ in prepared:
+        if event.total_tokens is None and (event.prompt_tokens is not None or event.completion_tokens is not None):
+            event.total_tokens = (event.prompt_tokens or 0) + (event.completion_tokens or 0)
+
+def estimate_cost(event: AIUsageEvent) -> None:
     # Calculate cost if not provided
     if event.cost_usd is None and event.total_tokens:
         # Basic cost estimation (can be enhanced)
         cost_per_token = 0.00002  # $0.02 per 1K tokens
         event.cost_usd = event.total_tokens * cost_per_token
+
+def enrich_usage_events(batch: List[AIUsageEventCreate]) -> List[Tuple[AIUsageEvent, Optional[str]]]:
+    """Redact, hash, count tokens and cost events without any I/O; returns events and raw prompts"""
+    prepared = [prepare_usage_event(event_data) for event_data in batch]
+    fill_token_counts(prepared)
+    for event, _, _ in prepared:
+        estimate_cost(event)
+    return [(event, prompt) for event, prompt, _ in prepared]
+
+def enrich_usage_event(event_data: AIUsageEventCreate) -> Tuple[AIUsageEvent, Optional[str]]:
+    """Enrich a single event; returns the event and raw prompt"""
+    return enrich_usage_events([event_data])[0]
+
+async def process_usage_events(batch: List[AIUsageEventCreate]) -> List[AIUsageEvent]:
+    """Process and enhance usage events"""
+    events = []
+    # Redaction and tokenization are CPU-bound; keep them off the event loop
+    for event, prompt in await asyncio.to_thread(enrich_usage_events, batch):
+        # Store full prompt to S3 if configured
+        if S3_ENABLED and prompt:
+            s3_key = f"prompts/{event.id}.txt"
+            if await store_to_s3(prompt, s3_key):
+                event.s3_key = s3_key
+        events.append(event)
+    return events
+
+async def process_usage_event(event_data: AIUsageEventCreate) -> AIUsageEvent:
+    """Process and enhance usage event"""
+    return (await process_usage_events([event_data]))[0]
+
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+# Write failures that mean the database is unreachable or overloaded, not that the event is bad
+DATABASE_UNAVAILABLE_ERRORS = (ConnectionFailure, ExecutionTimeout, WTimeoutError)
+
+async def insert_events_unordered(events: List[AIUsageEvent]) -> Dict[int, Dict[str, Any]]:
+    """Insert events with an unordered bulk write, returning write errors by position"""
+    if not events:
+        return {}
+    encoded = [encode_event(event.dict()) for event in events]
+    write_errors: Dict[int, Dict[str, Any]] = {}
+    try:
+        await db.ai_usage_events.insert_many([doc for doc, _ in encoded], ordered=False)
+    except BulkWriteError as e:
+        write_errors = {error['index']: error for error in e.details.get('writeErrors', [])}
+    
+    publish_inserted([event.dict() for i, event in enumerate(events) if i not in write_errors])
+    
+    prompts = [prompt for i, (_, prompt) in enumerate(encoded) if prompt and i not in write_errors]
+    if prompts:
+        try:
+            await db[PROMPTS_COLLECTION].insert_many(prompts, ordered=False)
+        except BulkWriteError as e:
+            logging.warning(f"Failed to offload {len(e.details.get('writeErrors', []))} prompts")
+    return write_errors
+
+def publish_inserted(events: List[Dict[str, Any]]) -> None:
+    """Feed newly stored events to the in-process consumers of the ingest stream"""
+    if not events:
+        return
+    if analytics_mirror:
+        analytics_mirror.append(events)
+    if alert_evaluator:
+        for event in events:
+            alerts = alert_evaluator.observe(event)
+            if alerts:
+                alert_dispatcher.submit(alerts)
+
+async def insert_event(event: AIUsageEvent) -> None:
+    """Insert a single event in the configured storage encoding"""
+    doc, prompt = encode_event(event.dict())
+    await db.ai_usage_events.insert_one(doc)
+    if prompt:
+        await db[PROMPTS_COLLECTION].replace_one({"_id": prompt["_id"]}, prompt, upsert=True)
+    publish_inserted([event.dict()])
+
+async def decode_event_documents(docs: List[Dict[str, Any]]) -> List[AIUsageEvent]:
+    """Decode stored documents, fetching any offloaded prompts in one query"""
+    prompts: Dict[str, str] = {}
+    ids = offloaded_ids(docs)
+    if ids:
+        async for prompt in db[PROMPTS_COLLECTION].find({"_id": {"$in": ids}}):
+            prompts[prompt["_id"]] = prompt.get(storage_field('redacted_prompt', compact=True))
+    return [AIUsageEvent(**decode_event(doc, prompts)) for doc in docs]
+
+def prompt_search_available() -> bool:
+    """Redacted prompts are text-indexed unless they are stored compressed"""
+    return not COMPACT_STORAGE or PROMPT_STORAGE != 'compress'
+
+async def search_usage_events(
+    search: str,
+    query: Dict[str, Any],
+    offset: int,
+    limit: int
+) -> List[AIUsageEvent]:
+    """Rank events by text score on the redacted prompt, newest first on ties"""
+    sort = [("score", {"$meta": "textScore"}), (storage_field("timestamp"), -1)]
+    if not (COMPACT_STORAGE and PROMPT_STORAGE == 'offload'):
+        events = await db.ai_usage_events.find(
+            {**query, "$text": {"$search": search}},
+            {"score": {"$meta": "textScore"}}
+        ).sort(sort).skip(offset).limit(limit).to_list(length=None)
+        return await decode_event_documents(events)
     
-    return event
+    # Offloaded prompts are indexed in their own collection; join back to the events
+    prompt_key = storage_field('redacted_prompt', compact=True)
+    results = await db[PROMPTS_COLLECTION].aggregate([
+        {"$match": {"$text": {"$search": search}}},
+        {"$project": {prompt_key: 1, "score": {"$meta": "textScore"}}},
+        {"$lookup": {"from": "ai_usage_events", "localField": "_id", "foreignField": "_id", "as": "event"}},
+        {"$unwind": "$event"},
+        {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$event", {"_score": "$score", "_prompt": f"${prompt_key}"}]}}},
+        {"$match": query},
+        {"$sort": {"_score": -1, storage_field("timestamp"): -1}},
+        {"$skip": offset},
+        {"$limit": limit}
+    ]).to_list(length=None)
+    prompts = {doc["_id"]: doc.pop("_prompt", None) for doc in results}
+    for doc in results:
+        doc.pop("_score", None)
+    return [AIUsageEvent(**decode_event(doc, prompts)) for doc in results]
+
+def spool_available() -> bool:
+    return ingest_spool is not None and ingest_spool.accepting
+
+async def spool_events(events: List[AIUsageEvent]) -> bool:
+    """Append events to the local spool for later replay; False if they couldn't be spooled"""
+    if not spool_available():
+        return False
+    try:
+        await asyncio.to_thread(ingest_spool.append, [event.json() for event in events])
+        return True
+    except SpoolFull as e:
+        logging.error(f"Spool rejected {len(events)} events: {e}")
+    except OSError as e:
+        logging.error(f"Failed to spool {len(events)} events: {e}")
+    return False
+
+async def acquire_replay_slot() -> float:
+    """Wait until the write pipeline is at most half full, then take a slot.
+    
+    Replay yields to live ingest instead of adding load to a busy database.
+    """
+    while True:
+        if not admission.max_inflight or admission.inflight * 2 < admission.max_inflight:
+            try:
+                return admission.acquire_write_slot()
+            except AdmissionRejected:
+                pass
+        await asyncio.sleep(max(admission.write_seconds, SPOOL_REPLAY_INTERVAL))
+
+async def replay_spooled_events(records: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Write a batch of spooled events; ids already stored are counted as duplicates"""
+    events = [AIUsageEvent(**record) for record in records]
+    started = await acquire_replay_slot()
+    try:
+        write_errors = await insert_events_unordered(events)
+    finally:
+        admission.release_write_slot(started)
+    duplicates = sum(1 for error in write_errors.values() if error.get('code') == DUPLICATE_KEY_ERROR_CODE)
+    for error in write_errors.values():
+        if error.get('code') != DUPLICATE_KEY_ERROR_CODE:
+            logging.error(f"Dropping spooled event {events[error['index']].id}: {error.get('errmsg')}")
+    return {
+        "inserted": len(events) - len(write_errors),
+        "duplicates": duplicates,
+        "failed": len(write_errors) - duplicates
+    }
+
+def admission_rejected(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": e.retry_after_header})
+
+def enforce_admission(events: List[Any]) -> None:
+    """Charge events to their user and service token buckets or reject with 429"""
+    try:
+        admission.admit(event_costs(events))
+    except AdmissionRejected as e:
+        raise admission_rejected(e)
+
+async def ingest_write_slot():
+    """Hold a write-pipeline slot for the duration of an ingest request.
+    
+    Yields False when the request should go to the spool instead: a recent
+    write found the database unavailable, or the pipeline is full and
+    SPOOL_ON_OVERLOAD is set. Otherwise a full pipeline is rejected with 429.
+    """
+    if ingest_spool is not None and ingest_spool.database_down and spool_available():
+        yield False
+        return
+    try:
+        started = admission.acquire_write_slot()
+    except AdmissionRejected as e:
+        if SPOOL_ON_OVERLOAD and spool_available():
+            yield False
+            return
+        raise admission_rejected(e)
+    try:
+        yield True
+    finally:
+        admission.release_write_slot(started)
 
 # Authentication (basic for MVP)
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
@@ -231,43 +565,130 @@ async def root():
 @api_router.post("/v1/ai-usage/events", response_model=AIUsageEvent)
 async def create_usage_event(
     event_data: AIUsageEventCreate,
-    current_user: User = Depends(get_current_user)
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    write_slot: bool = Depends(ingest_write_slot)
 ):
-    """Create a single AI usage event"""
+    """Create a single AI usage event; 202 when it was spooled for a later write"""
+    enforce_admission([{"user_id": event_data.user_id, "service": event_data.service}])
     try:
         event = await process_usage_event(event_data)
         
-        # Store in MongoDB
-        await db.ai_usage_events.insert_one(event.dict())
+        if not write_slot and await spool_events([event]):
+            response.status_code = 202
+            return event
+        
+        # Store in MongoDB; a retried event with the same id returns the stored copy
+        try:
+            await insert_event(event)
+        except DuplicateKeyError:
+            existing = await db.ai_usage_events.find_one(translate_query({"id": event.id}))
+            if existing:
+                return (await decode_event_documents([existing]))[0]
+            raise
+        except DATABASE_UNAVAILABLE_ERRORS as e:
+            if not await spool_events([event]):
+                raise
+            logging.warning(f"Database unavailable, spooled event {event.id}: {e}")
+            ingest_spool.database_down = True
+            response.status_code = 202
         
         return event
     except Exception as e:
         logging.error(f"Error creating usage event: {e}")
         raise HTTPException(status_code=500, detail="Failed to create usage event")
 
-@api_router.post("/v1/ai-usage/events/batch", response_model=List[AIUsageEvent])
+@api_router.post("/v1/ai-usage/events/batch", response_model=BatchIngestResponse)
 async def create_usage_events_batch(
     batch_data: AIUsageEventBatch,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    write_slot: bool = Depends(ingest_write_slot)
 ):
-    """Create multiple AI usage events in batch"""
+    """Create multiple AI usage events in batch with per-item results"""
+    enforce_admission(batch_data.events)
     try:
-        events = []
-        for event_data in batch_data.events:
-            event = await process_usage_event(event_data)
-            events.append(event)
+        results: List[BatchItemResult] = []
+        valid: List[Tuple[int, AIUsageEventCreate]] = []
+        for index, raw_event in enumerate(batch_data.events):
+            if not isinstance(raw_event, dict):
+                results.append(BatchItemResult(index=index, status=IngestStatus.INVALID, error="Event must be a JSON object"))
+                continue
+            try:
+                valid.append((index, AIUsageEventCreate(**raw_event)))
+            except ValidationError as e:
+                results.append(BatchItemResult(
+                    index=index,
+                    id=raw_event.get('id') if isinstance(raw_event.get('id'), str) else None,
+                    status=IngestStatus.INVALID,
+                    error=str(e.errors()[0].get('msg')) if e.errors() else "Invalid event"
+                ))
         
-        # Batch insert to MongoDB
-        if events:
-            await db.ai_usage_events.insert_many([event.dict() for event in events])
+        # Enrich valid items together so missing token counts are encoded in one batch
+        events = await process_usage_events([event_data for _, event_data in valid])
+        pending = [
+            BatchItemResult(index=index, id=event.id, status=IngestStatus.INSERTED, event=event)
+            for (index, _), event in zip(valid, events)
+        ]
+        results = sorted(results + pending, key=lambda r: r.index)
+
+        spooled = False
+        write_errors: Dict[int, Dict[str, Any]] = {}
+        if not write_slot:
+            spooled = await spool_events(events)
+        if not spooled:
+            # Unordered insert so one failing document doesn't abort the rest
+            try:
+                write_errors = await insert_events_unordered(events)
+            except DATABASE_UNAVAILABLE_ERRORS as e:
+                # Some documents may have been written; replay drops them as duplicates
+                if not await spool_events(events):
+                    raise
+                logging.warning(f"Database unavailable, spooled {len(events)} events: {e}")
+                ingest_spool.database_down = True
+                spooled = True
+        if spooled:
+            for result in pending:
+                result.status = IngestStatus.SPOOLED
+        
+        for position, error in write_errors.items():
+            result = pending[position]
+            result.event = None
+            if error.get('code') == DUPLICATE_KEY_ERROR_CODE:
+                result.status = IngestStatus.DUPLICATE
+            else:
+                result.status = IngestStatus.FAILED
+                result.error = error.get('errmsg')
         
-        return events
+        return BatchIngestResponse(
+            inserted=sum(1 for r in results if r.status == IngestStatus.INSERTED),
+            duplicates=sum(1 for r in results if r.status == IngestStatus.DUPLICATE),
+            invalid=sum(1 for r in results if r.status == IngestStatus.INVALID),
+            failed=sum(1 for r in results if r.status == IngestStatus.FAILED),
+            spooled=sum(1 for r in results if r.status == IngestStatus.SPOOLED),
+            results=results
+        )
     except Exception as e:
         logging.error(f"Error creating batch usage events: {e}")
         raise HTTPException(status_code=500, detail="Failed to create batch usage events")
 
+@api_router.get("/v1/ai-usage/admission/stats")
+async def get_admission_stats(
+    top: int = Query(20, ge=1, le=500),
+    current_user: User = Depends(get_current_user)
+):
+    """Get ingestion admission counters, including the most throttled users and services"""
+    return admission.stats(top)
+
+@api_router.get("/v1/ai-usage/spool/stats")
+async def get_spool_stats(current_user: User = Depends(get_current_user)):
+    """Get ingest spool depth and replay progress"""
+    if ingest_spool is None:
+        return {"enabled": False}
+    return ingest_spool.stats()
+
 @api_router.get("/v1/ai-usage/events", response_model=List[AIUsageEvent])
 async def get_usage_events(
+    request: Request,
     limit: int = Query(100, ge=1, le=1000),
     offset: int = Query(0, ge=0),
     provider: Optional[AIProvider] = None,
@@ -276,9 +697,12 @@ async def get_usage_events(
     service: Optional[str] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
+    q: Optional[str] = Query(None, min_length=1, max_length=512),
     current_user: User = Depends(get_current_user)
 ):
-    """Get AI usage events with filtering"""
+    """Get AI usage events with filtering and optional full-text search over redacted prompts"""
+    if q and not prompt_search_available():
+        raise HTTPException(status_code=400, detail="Prompt search is unavailable with compressed prompt storage")
     try:
         query = {}
         
@@ -299,8 +723,11 @@ async def get_usage_events(
                 date_query["$lte"] = end_date
             query["timestamp"] = date_query
         
-        events = await db.ai_usage_events.find(query).skip(offset).limit(limit).sort("timestamp", -1).to_list(length=None)
-        return [AIUsageEvent(**event) for event in events]
+        if q:
+            return encoded_response(request, await search_usage_events(q, translate_query(query), offset, limit))
+        
+        events = await db.ai_usage_events.find(translate_query(query)).skip(offset).limit(limit).sort(storage_field("timestamp"), -1).to_list(length=None)
+        return encoded_response(request, await decode_event_documents(events))
         
     except Exception as e:
         logging.error(f"Error retrieving usage events: {e}")
@@ -308,6 +735,7 @@ async def get_usage_events(
 
 @api_router.get("/v1/ai-usage/analytics", response_model=AnalyticsResponse)
 async def get_analytics(
+    request: Request,
     days: int = Query(7, ge=1, le=365),
     current_user: User = Depends(get_current_user)
 ):
@@ -316,30 +744,34 @@ async def get_analytics(
         start_date = datetime.now(timezone.utc) - timedelta(days=days)
         last_24h = datetime.now(timezone.utc) - timedelta(hours=24)
         
+        # Stored field references for the configured storage encoding
+        fields = {name: storage_field(name) for name in ("timestamp", "provider", "model", "user_id", "service", "cost_usd")}
+        refs = {name: f"${key}" for name, key in fields.items()}
+        
         # Aggregation pipelines
         total_events = await db.ai_usage_events.count_documents({})
         total_cost_result = await db.ai_usage_events.aggregate([
-            {"$group": {"_id": None, "total": {"$sum": "$cost_usd"}}}
+            {"$group": {"_id": None, "total": {"$sum": refs["cost_usd"]}}}
         ]).to_list(1)
         total_cost = total_cost_result[0]["total"] if total_cost_result else 0.0
         
         events_last_24h = await db.ai_usage_events.count_documents({
-            "timestamp": {"$gte": last_24h}
+            fields["timestamp"]: {"$gte": last_24h}
         })
         
         cost_last_24h_result = await db.ai_usage_events.aggregate([
-            {"$match": {"timestamp": {"$gte": last_24h}}},
-            {"$group": {"_id": None, "total": {"$sum": "$cost_usd"}}}
+            {"$match": {fields["timestamp"]: {"$gte": last_24h}}},
+            {"$group": {"_id": None, "total": {"$sum": refs["cost_usd"]}}}
         ]).to_list(1)
         cost_last_24h = cost_last_24h_result[0]["total"] if cost_last_24h_result else 0.0
         
         # Top models
         top_models = await db.ai_usage_events.aggregate([
-            {"$match": {"timestamp": {"$gte": start_date}}},
+            {"$match": {fields["timestamp"]: {"$gte": start_date}}},
             {"$group": {
-                "_id": {"provider": "$provider", "model": "$model"},
+                "_id": {"provider": refs["provider"], "model": refs["model"]},
                 "count": {"$sum": 1},
-                "cost": {"$sum": "$cost_usd"}
+                "cost": {"$sum": refs["cost_usd"]}
             }},
             {"$sort": {"count": -1}},
             {"$limit": 5},
@@ -351,14 +783,16 @@ async def get_analytics(
                 "_id": 0
             }}
         ]).to_list(5)
+        for entry in top_models:
+            entry["provider"] = decode_value("provider", entry.get("provider"))
         
         # Top users
         top_users = await db.ai_usage_events.aggregate([
-            {"$match": {"timestamp": {"$gte": start_date}}},
+            {"$match": {fields["timestamp"]: {"$gte": start_date}}},
             {"$group": {
-                "_id": "$user_id",
+                "_id": refs["user_id"],
                 "count": {"$sum": 1},
-                "cost": {"$sum": "$cost_usd"}
+                "cost": {"$sum": refs["cost_usd"]}
             }},
             {"$sort": {"count": -1}},
             {"$limit": 5},
@@ -372,11 +806,11 @@ async def get_analytics(
         
         # Top services
         top_services = await db.ai_usage_events.aggregate([
-            {"$match": {"timestamp": {"$gte": start_date}}},
+            {"$match": {fields["timestamp"]: {"$gte": start_date}}},
             {"$group": {
-                "_id": "$service",
+                "_id": refs["service"],
                 "count": {"$sum": 1},
-                "cost": {"$sum": "$cost_usd"}
+                "cost": {"$sum": refs["cost_usd"]}
             }},
             {"$sort": {"count": -1}},
             {"$limit": 5},
@@ -390,16 +824,16 @@ async def get_analytics(
         
         # Usage over time (daily)
         usage_over_time = await db.ai_usage_events.aggregate([
-            {"$match": {"timestamp": {"$gte": start_date}}},
+            {"$match": {fields["timestamp"]: {"$gte": start_date}}},
             {"$group": {
                 "_id": {
                     "$dateToString": {
                         "format": "%Y-%m-%d",
-                        "date": "$timestamp"
+                        "date": refs["timestamp"]
                     }
                 },
                 "count": {"$sum": 1},
-                "cost": {"$sum": "$cost_usd"}
+                "cost": {"$sum": refs["cost_usd"]}
             }},
             {"$sort": {"_id": 1}},
             {"$project": {
@@ -410,7 +844,7 @@ async def get_analytics(
             }}
         ]).to_list(days)
         
-        return AnalyticsResponse(
+        return encoded_object_response(request, AnalyticsResponse(
             total_events=total_events,
             total_cost=total_cost,
             events_last_24h=events_last_24h,
@@ -419,12 +853,133 @@ async def get_analytics(
             top_users=top_users,
             top_services=top_services,
             usage_over_time=usage_over_time
-        )
+        ))
         
     except Exception as e:
         logging.error(f"Error retrieving analytics: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve analytics")
 
+@api_router.post("/v1/ai-usage/analytics/query", response_model=AnalyticsQueryResponse)
+async def query_analytics(
+    request: Request,
+    analytics_query: AnalyticsQuery,
+    current_user: User = Depends(get_current_user)
+):
+    """Run an ad-hoc group-by against the columnar analytics mirror"""
+    if not analytics_mirror:
+        raise HTTPException(status_code=503, detail="Analytics engine is not available")
+    # Totals would silently miss events while the mirror is catching up from MongoDB
+    if not analytics_mirror.synced:
+        raise HTTPException(status_code=503, detail="Analytics engine is syncing, retry shortly")
+    try:
+        sql, params, columns = build_query(
+            analytics_query.dimensions,
+            analytics_query.measures,
+            analytics_query.filters,
+            analytics_query.start_date,
+            analytics_query.end_date,
+            analytics_query.granularity,
+            analytics_query.order_by,
+            analytics_query.limit
+        )
+    except AnalyticsQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        rows, elapsed_ms = await asyncio.to_thread(timed, analytics_mirror.query, sql, params, columns)
+        if negotiate(request.headers.get('accept')) == ARROW:
+            return encoded_response(request, rows)
+        return encoded_object_response(request, AnalyticsQueryResponse(
+            columns=columns,
+            rows=rows,
+            row_count=len(rows),
+            elapsed_ms=round(elapsed_ms, 2)
+        ))
+    except Exception as e:
+        logging.error(f"Error running analytics query: {e}")
+        raise HTTPException(status_code=500, detail="Failed to run analytics query")
+
+@api_router.get("/v1/ai-usage/alerts", response_model=List[Alert])
+async def get_alerts(
+    limit: int = Query(100, ge=1, le=1000),
+    rule: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Get the most recent alerts raised by the streaming evaluator"""
+    try:
+        query = {"rule": rule} if rule else {}
+        alerts = await db[ALERTS_COLLECTION].find(query).sort("triggered_at", -1).limit(limit).to_list(length=None)
+        return [Alert(**alert) for alert in alerts]
+    except Exception as e:
+        logging.error(f"Error retrieving alerts: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve alerts")
+
+@api_router.get("/v1/ai-usage/alerts/rules", response_model=List[AlertRule])
+async def get_alert_rules(current_user: User = Depends(get_current_user)):
+    """Get the configured alert rules"""
+    return alert_evaluator.rules if alert_evaluator else []
+
+@api_router.get("/v1/ai-usage/timeseries", response_model=TimeSeriesResponse)
+async def get_timeseries(
+    request: Request,
+    days: int = Query(7, ge=1, le=365),
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    granularity: str = Query("auto", pattern="^(auto|minute|5minutes|15minutes|hour|6hours|day)$"),
+    points: int = Query(500, ge=10, le=5000),
+    measure: str = Query("count", pattern="^(count|cost|tokens)$"),
+    provider: Optional[AIProvider] = None,
+    model: Optional[str] = None,
+    user_id: Optional[str] = None,
+    service: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Get a bucketed usage series downsampled to about `points` samples for charting"""
+    end = as_utc(end_date) if end_date else datetime.now(timezone.utc)
+    start = as_utc(start_date) if start_date else end - timedelta(days=days)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start_date must be before end_date")
+    try:
+        granularity = choose_granularity(start, end, granularity, points)
+    except TimeSeriesError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    step = GRANULARITY_SECONDS[granularity]
+    
+    filters = {name: value for name, value in (
+        ("provider", provider), ("model", model), ("user_id", user_id), ("service", service)
+    ) if value}
+    
+    try:
+        if analytics_mirror and analytics_mirror.synced:
+            source = "columnar"
+            sql, params, columns = columnar_query(step, filters, start, end)
+            rows = await asyncio.to_thread(analytics_mirror.query, sql, params, columns)
+            rows = [(row["bucket"], row["count"], row["cost"], row["tokens"]) for row in rows]
+        else:
+            source = "mongo"
+            refs = {name: f"${storage_field(name)}" for name in (
+                "timestamp", "cost_usd", "total_tokens", "prompt_tokens", "completion_tokens"
+            )}
+            match = translate_query({**filters, "timestamp": {"$gte": start, "$lte": end}})
+            results = await db.ai_usage_events.aggregate(
+                mongo_pipeline(step, match, refs, COMPACT_STORAGE)
+            ).to_list(length=None)
+            rows = [(r["bucket"], r["count"], r["cost"], r["tokens"]) for r in results]
+        
+        series = fill_buckets(rows, start, end, step)
+        return encoded_object_response(request, TimeSeriesResponse(
+            granularity=granularity,
+            measure=measure,
+            start_date=start,
+            end_date=end,
+            source=source,
+            raw_points=len(series),
+            points=format_points(downsample(series, measure, points))
+        ))
+    except Exception as e:
+        logging.error(f"Error retrieving time series: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve time series")
+
 @api_router.post("/v1/ai-usage/generate-demo-data")
 async def generate_demo_data(
     count: int = Query(50, ge=1, le=1000),
@@ -483,7 +1038,7 @@ async def generate_demo_data(
         
         # Insert demo data
         if demo_events:
-            await db.ai_usage_events.insert_many([event.dict() for event in demo_events])
+            await insert_events_unordered(demo_events)
         
         return {"message": f"Generated {len(demo_events)} demo events", "count": len(demo_events)}
         
@@ -502,6 +1057,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Response compression above a size threshold (brotli when available, else gzip)
+compression_min_bytes = COMPRESSION_MIN_BYTES
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(BrotliMiddleware, minimum_size=compression_min_bytes, gzip_fallback=True)
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=compression_min_bytes)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -509,6 +1072,152 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def start_spool():
+    global ingest_spool
+    # Spooled events must outlive the process, which serverless instances don't guarantee
+    if LAZY_INIT:
+        return
+    # Opened before anything touches MongoDB so ingest is covered while it is unreachable
+    ingest_spool = await asyncio.to_thread(create_spool)
+    if ingest_spool:
+        if ingest_spool.pending_records:
+            logger.info(f"Replaying {ingest_spool.pending_records} spooled events")
+        ingest_spool.start(replay_spooled_events)
+
+@app.on_event("startup")
+async def warm_clients():
+    # Long-running servers connect up front so the first request isn't slower
+    if LAZY_INIT:
+        return
+    get_client()
+    get_s3_client()
+    await asyncio.to_thread(warm_tokenizers)
+
+# Background startup steps, kept referenced until they finish
+startup_tasks = set()
+
+async def retry_until_done(name: str, step) -> None:
+    """Run a startup step that needs MongoDB, retrying with backoff until it succeeds"""
+    delay = 1.0
+    while True:
+        try:
+            await step()
+            return
+        except Exception as e:
+            logging.error(f"{name} failed, retrying in {delay:.0f}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60.0)
+
+def run_in_background(name: str, step) -> None:
+    # Startup must not wait on (or die with) an unreachable database
+    task = asyncio.create_task(retry_until_done(name, step))
+    startup_tasks.add(task)
+    task.add_done_callback(startup_tasks.discard)
+
+async def ensure_indexes():
+    # Unique event id makes client retries idempotent; compact documents use _id
+    if not COMPACT_STORAGE:
+        await db.ai_usage_events.create_index("id", unique=True)
+    await db.ai_usage_events.create_index([(storage_field("timestamp"), -1)])
+    
+    # Text index backing prompt search (only one text index per collection)
+    if COMPACT_STORAGE and PROMPT_STORAGE == 'offload':
+        await db[PROMPTS_COLLECTION].create_index([(storage_field('redacted_prompt', compact=True), "text")])
+    elif prompt_search_available():
+        await db.ai_usage_events.create_index([(storage_field('redacted_prompt'), "text")])
+
+@app.on_event("startup")
+async def create_indexes():
+    # In lazy mode run provision_indexes.py as a deploy step instead
+    if LAZY_INIT:
+        return
+    run_in_background("Index creation", ensure_indexes)
+
+@app.on_event("startup")
+async def start_analytics_mirror():
+    global analytics_mirror
+    # The mirror needs a persistent process and local disk
+    if LAZY_INIT:
+        return
+    analytics_mirror = create_mirror()
+    if analytics_mirror:
+        analytics_mirror.start()
+        asyncio.create_task(sync_analytics_mirror())
+
+async def rebuild_alert_evaluator(rules: List[AlertRule]) -> None:
+    global alert_evaluator, alert_dispatcher
+    evaluator = AlertEvaluator(rules)
+    # Rebuild window state from recent events without re-raising old alerts
+    since = datetime.now(timezone.utc) - timedelta(seconds=2 * evaluator.max_window_seconds)
+    ts_field = storage_field("timestamp")
+    async for doc in db.ai_usage_events.find(translate_query({"timestamp": {"$gte": since}})).sort(ts_field, 1):
+        evaluator.observe(decode_event(doc), emit=False)
+    fired_since = datetime.now(timezone.utc) - timedelta(seconds=evaluator.max_cooldown_seconds)
+    evaluator.restore_cooldowns(await db[ALERTS_COLLECTION].find({"triggered_at": {"$gte": fired_since}}).to_list(length=None))
+    logger.info(f"Alert evaluator rebuilt from {evaluator.events_observed} events with {len(rules)} rules")
+    
+    alert_dispatcher = AlertDispatcher(db)
+    alert_dispatcher.start()
+    alert_evaluator = evaluator
+
+@app.on_event("startup")
+async def start_alerts():
+    # Sliding windows can't survive short-lived serverless instances
+    if LAZY_INIT:
+        return
+    try:
+        rules = load_rules()
+    except Exception as e:
+        logging.error(f"Alert rules not loaded: {e}")
+        return
+    if not rules:
+        return
+    # Alerts are evaluated once the rebuild has succeeded
+    run_in_background("Alert evaluator rebuild", lambda: rebuild_alert_evaluator(rules))
+
+async def sync_analytics_mirror():
+    """Catch the columnar mirror up with events it didn't see being ingested.
+    
+    At startup that is whatever was written while it was offline; afterwards it
+    is backfills by other writers, which leave resync requests behind. Requests
+    are never deleted: each mirror records the last version it applied.
+    """
+    while True:
+        try:
+            requests = await db[SYNC_COLLECTION].find(
+                pending_resync_query(analytics_mirror.resync_version)
+            ).to_list(length=None)
+            if requests or not analytics_mirror.synced:
+                backfilled_since = min((r["backfilled_since"] for r in requests), default=None)
+                start = resync_start_time(analytics_mirror.latest_at_open, analytics_mirror.synced, backfilled_since)
+                if start is None:
+                    # A full backfill covers every request made before it starts
+                    counter = await db[SYNC_COLLECTION].find_one({"_id": MIRROR_SYNC_ID})
+                    version = counter["version"] if counter else 0
+                else:
+                    version = max((r["version"] for r in requests), default=analytics_mirror.resync_version)
+                # Reads fall back to MongoDB until the backfilled range is mirrored
+                analytics_mirror.synced = False
+                query = translate_query({"timestamp": {"$gte": start}}) if start else {}
+                synced = await analytics_mirror.sync_from(db.ai_usage_events.find(query), decode_event)
+                if version != analytics_mirror.resync_version:
+                    await asyncio.to_thread(analytics_mirror.save_resync_version, version)
+                analytics_mirror.synced = True
+                logger.info(f"Analytics mirror synced {synced} events since {start or 'the beginning'}")
+        except Exception as e:
+            logging.error(f"Analytics mirror sync failed: {e}")
+        await asyncio.sleep(ANALYTICS_RESYNC_INTERVAL)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    if analytics_mirror:
+        await analytics_mirror.close()
+    if alert_dispatcher:
+        alert_dispatcher.stop()
+    for task in startup_tasks:
+        task.cancel()
+    if ingest_spool:
+        ingest_spool.close()
+    if client:
+        client.close()
\ No newline at end of file
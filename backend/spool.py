@@ -0,0 +1,329 @@
+"""Durable on-disk spool for events that could not be written to MongoDB.
+
+When the database is unreachable, enriched events are appended to local
+segment files instead of being dropped, and a background replayer drains them
+back in bulk once writes succeed again. A full write pipeline is load shedding
+(429) rather than an outage, so it only spools with SPOOL_ON_OVERLOAD.
+Every record is one line prefixed with its CRC32, so a write torn by a crash
+is detected and skipped. The replay cursor is saved after each batch without
+fsync: a cursor that lags only re-sends events already stored, and those are
+rejected as duplicate ids.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; the spool directory is then unguarded
+    fcntl = None
+
+ROOT_DIR = Path(__file__).parent
+
+SPOOL_ENABLED = os.environ.get('INGEST_SPOOL', 'true').lower() in ('1', 'true', 'yes')
+SPOOL_DIR = os.environ.get('SPOOL_DIR', str(ROOT_DIR / 'spool'))
+SPOOL_SEGMENT_BYTES = int(os.environ.get('SPOOL_SEGMENT_BYTES', str(64 * 1024 * 1024)))
+SPOOL_MAX_BYTES = int(os.environ.get('SPOOL_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))
+# fsync each append before the request is acknowledged
+SPOOL_FSYNC = os.environ.get('SPOOL_FSYNC', 'true').lower() in ('1', 'true', 'yes')
+# Also spool (202) instead of rejecting (429) when the write pipeline is full
+SPOOL_ON_OVERLOAD = os.environ.get('SPOOL_ON_OVERLOAD', 'false').lower() in ('1', 'true', 'yes')
+SPOOL_REPLAY_BATCH = int(os.environ.get('SPOOL_REPLAY_BATCH', '1000'))
+SPOOL_REPLAY_INTERVAL = float(os.environ.get('SPOOL_REPLAY_INTERVAL', '1.0'))
+SPOOL_MAX_BACKOFF = float(os.environ.get('SPOOL_MAX_BACKOFF', '30'))
+SPOOL_RATE_WINDOW = 60
+
+SEGMENT_PATTERN = 'segment-*.log'
+CURSOR_FILE = 'cursor.json'
+LOCK_FILE = 'spool.lock'
+
+# Replays a batch of spooled events; returns counts such as inserted/duplicates/failed
+ReplayHandler = Callable[[List[Dict[str, Any]]], Awaitable[Dict[str, int]]]
+
+
+class SpoolFull(Exception):
+    """Raised when an append would grow the spool past SPOOL_MAX_BYTES"""
+
+
+class SpoolLocked(Exception):
+    """Raised when another process already owns the spool directory"""
+
+
+def encode_record(payload: str) -> bytes:
+    data = payload.encode()
+    return b'%08x %s\n' % (zlib.crc32(data), data)
+
+
+def decode_record(line: bytes) -> Optional[Dict[str, Any]]:
+    """Parse one spooled line; None for a torn or corrupt record"""
+    if len(line) < 10 or not line.endswith(b'\n') or line[8:9] != b' ':
+        return None
+    data = line[9:-1]
+    try:
+        if int(line[:8], 16) != zlib.crc32(data):
+            return None
+        return json.loads(data)
+    except ValueError:
+        return None
+
+
+class EventSpool:
+    """Append-only segment files with a replay cursor"""
+
+    def __init__(
+        self,
+        path: str = SPOOL_DIR,
+        segment_bytes: int = SPOOL_SEGMENT_BYTES,
+        max_bytes: int = SPOOL_MAX_BYTES,
+        fsync: bool = SPOOL_FSYNC
+    ):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        # One process per directory: a second writer would unlink segments the first is appending to
+        self.lock_file = open(self.path / LOCK_FILE, 'a')
+        if fcntl:
+            try:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.lock_file.close()
+                raise SpoolLocked(f"{self.path} is in use by another process")
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.totals = Counter()
+        self.replayed = deque()  # (monotonic time, events) for the replay rate
+        self.last_error: Optional[str] = None
+        self.last_replayed_at: Optional[float] = None
+        # Set when a direct write failed; ingest goes straight to the spool until a replay succeeds
+        self.database_down = False
+        self._task: Optional[asyncio.Task] = None
+
+        self.cursor = self._load_cursor()
+        self.segments: Dict[int, int] = {}
+        segment_paths = sorted(self.path.glob(SEGMENT_PATTERN))
+        for segment_path in segment_paths:
+            segment = int(segment_path.stem.split('-')[1])
+            size = segment_path.stat().st_size
+            if segment < self.cursor[0] or (size == 0 and segment_path != segment_paths[-1]):
+                # Fully replayed before the last shutdown, or left empty by an earlier run
+                segment_path.unlink()
+            else:
+                self.segments[segment] = size
+        if self.cursor[0] not in self.segments:
+            self.cursor = (self.cursor[0], 0)
+        self.pending_records = self._count_pending()
+
+        # Append to an empty tail segment, otherwise a fresh one so a torn tail is never extended
+        tail = max(self.segments, default=None)
+        if tail is not None and self.segments[tail] == 0:
+            self.active = tail
+        else:
+            self.active = max(self.segments, default=self.cursor[0]) + 1
+            self.segments[self.active] = 0
+        self.file = open(self._segment_path(self.active), 'ab')
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.path / f"segment-{segment:012d}.log"
+
+    def _load_cursor(self) -> Tuple[int, int]:
+        try:
+            with open(self.path / CURSOR_FILE) as f:
+                cursor = json.load(f)
+            return cursor['segment'], cursor['offset']
+        except FileNotFoundError:
+            return 0, 0
+
+    def _save_cursor(self) -> None:
+        tmp = self.path / (CURSOR_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'segment': self.cursor[0], 'offset': self.cursor[1]}, f)
+        os.replace(tmp, self.path / CURSOR_FILE)
+
+    def _count_pending(self) -> int:
+        count = 0
+        for segment in sorted(self.segments):
+            with open(self._segment_path(segment), 'rb') as f:
+                if segment == self.cursor[0]:
+                    f.seek(self.cursor[1])
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    count += chunk.count(b'\n')
+        return count
+
+    @property
+    def pending_bytes(self) -> int:
+        return sum(self.segments.values()) - self.cursor[1]
+
+    @property
+    def accepting(self) -> bool:
+        return self.pending_bytes < self.max_bytes
+
+    def append(self, payloads: List[str]) -> None:
+        """Durably append serialized events; raises SpoolFull when over capacity"""
+        data = b''.join(encode_record(payload) for payload in payloads)
+        with self.lock:
+            if self.pending_bytes + len(data) > self.max_bytes:
+                self.totals['rejected'] += len(payloads)
+                raise SpoolFull(f"Spool is over {self.max_bytes} bytes")
+            if self.segments[self.active] and self.segments[self.active] + len(data) > self.segment_bytes:
+                self._rotate()
+            self.file.write(data)
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+            self.segments[self.active] += len(data)
+            self.pending_records += len(payloads)
+            self.totals['spooled'] += len(payloads)
+
+    def _rotate(self) -> None:
+        self.file.close()
+        self.active += 1
+        self.file = open(self._segment_path(self.active), 'ab')
+        self.segments[self.active] = 0
+
+    def read_batch(self, limit: int) -> Tuple[List[Dict[str, Any]], Tuple[int, int], int]:
+        """Read up to ``limit`` records after the cursor; returns (records, next cursor, lines read)"""
+        with self.lock:
+            # Sizes only grow by whole records, so reading up to them never sees a partial append
+            segments = sorted(self.segments.items())
+        segment, offset = self.cursor
+        records: List[Dict[str, Any]] = []
+        lines = 0
+        for current, size in segments:
+            if current < segment:
+                continue
+            if current > segment:
+                segment, offset = current, 0
+            if offset >= size:
+                continue
+            with open(self._segment_path(current), 'rb') as f:
+                f.seek(offset)
+                while offset < size and lines < limit:
+                    line = f.readline(size - offset)
+                    offset += len(line)
+                    lines += 1
+                    record = decode_record(line)
+                    if record is None:
+                        logging.warning(f"Skipping corrupt spool record in segment {current} before offset {offset}")
+                    else:
+                        records.append(record)
+            if lines >= limit:
+                break
+        return records, (segment, offset), lines
+
+    def commit(self, cursor: Tuple[int, int], lines: int) -> None:
+        """Advance the cursor past replayed records and delete drained segments"""
+        with self.lock:
+            segment, offset = cursor
+            if segment == self.active and offset and offset == self.segments[self.active]:
+                # Active segment fully drained; start a new one so it can be removed
+                self._rotate()
+                segment, offset = self.active, 0
+            self.cursor = (segment, offset)
+            self.pending_records = max(0, self.pending_records - lines)
+            drained = [s for s in self.segments if s < segment]
+            for s in drained:
+                del self.segments[s]
+            self._save_cursor()
+        for s in drained:
+            try:
+                self._segment_path(s).unlink()
+            except FileNotFoundError:
+                pass
+
+    async def replay_once(self, handler: ReplayHandler, limit: int = SPOOL_REPLAY_BATCH) -> int:
+        """Replay one batch; returns the number of records consumed"""
+        records, cursor, lines = await asyncio.to_thread(self.read_batch, limit)
+        if not lines:
+            return 0
+        if records:
+            self.totals.update(await handler(records))
+        await asyncio.to_thread(self.commit, cursor, lines)
+        self.totals['corrupt'] += lines - len(records)
+        now = time.monotonic()
+        self.replayed.append((now, len(records)))
+        self.last_replayed_at = now
+        return lines
+
+    async def run_replayer(self, handler: ReplayHandler) -> None:
+        backoff = SPOOL_REPLAY_INTERVAL
+        while True:
+            try:
+                consumed = await self.replay_once(handler)
+            except Exception as e:
+                self.last_error = str(e)
+                logging.warning(f"Spool replay failed, retrying in {backoff:.0f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, SPOOL_MAX_BACKOFF)
+                continue
+            backoff = SPOOL_REPLAY_INTERVAL
+            if consumed:
+                if self.database_down:
+                    logging.info("Database writes recovered, draining spool")
+                self.database_down = False
+                self.last_error = None
+            else:
+                await asyncio.sleep(SPOOL_REPLAY_INTERVAL)
+
+    def replay_rate(self) -> float:
+        """Events replayed per second over the last SPOOL_RATE_WINDOW seconds"""
+        horizon = time.monotonic() - SPOOL_RATE_WINDOW
+        while self.replayed and self.replayed[0][0] < horizon:
+            self.replayed.popleft()
+        return sum(count for _, count in self.replayed) / SPOOL_RATE_WINDOW
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            pending_bytes = self.pending_bytes
+            segments = len(self.segments)
+        return {
+            "enabled": True,
+            "database_down": self.database_down,
+            "pending_events": self.pending_records,
+            "pending_bytes": pending_bytes,
+            "max_bytes": self.max_bytes,
+            "segments": segments,
+            "replay_rate_per_second": round(self.replay_rate(), 2),
+            "seconds_since_last_replay": (
+                round(time.monotonic() - self.last_replayed_at, 1) if self.last_replayed_at else None
+            ),
+            "spooled_events": self.totals['spooled'],
+            "replayed_events": self.totals['inserted'],
+            "duplicate_events": self.totals['duplicates'],
+            "failed_events": self.totals['failed'],
+            "rejected_events": self.totals['rejected'],
+            "corrupt_records": self.totals['corrupt'],
+            "last_replay_error": self.last_error,
+        }
+
+    def start(self, handler: ReplayHandler) -> None:
+        self._task = asyncio.create_task(self.run_replayer(handler))
+
+    def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+        with self.lock:
+            self.file.close()
+        # Closing the file releases the directory lock
+        self.lock_file.close()
+
+
+def create_spool() -> Optional[EventSpool]:
+    """Open the spool directory if spooling is enabled"""
+    if not SPOOL_ENABLED:
+        return None
+    try:
+        return EventSpool()
+    except SpoolLocked as e:
+        logging.warning(f"Ingest spool disabled: {e}; give each worker its own SPOOL_DIR")
+        return None
+    except Exception as e:
+        logging.warning(f"Ingest spool not initialized: {e}")
+        return None
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Report cold-start import time of the API, broken down per import.
+
+    python startup_report.py [--top 15] [--budget-ms 800] [--runs 3]
+
+Imports ``server`` in fresh interpreters with ``-X importtime`` (so the
+numbers include everything a serverless cold start pays before the first
+request) and prints the slowest direct imports of the app, grouped by
+top-level package. With ``--budget-ms`` the exit status is non-zero when
+the median total exceeds the budget, so it can gate CI.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def measure(module: str):
+    """Import module in a fresh interpreter; returns (total_us, {package: cumulative_us})"""
+    env = dict(os.environ)
+    env.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+    env.setdefault('DB_NAME', 'startup_report')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        sys.exit(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    total = 0
+    packages = defaultdict(int)
+    depth_of_module = None
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        cumulative, depth, name = int(match.group(2)), len(match.group(3)) // 2, match.group(4)
+        if name == module and depth == 0:
+            total = cumulative
+            depth_of_module = depth
+        elif depth == 1:
+            # Direct imports of the app (their children are included in cumulative)
+            packages[name.split('.')[0]] += cumulative
+    if depth_of_module is None:
+        sys.exit(f"No import timing found for {module}")
+    return total, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='server')
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--budget-ms', type=float)
+    args = parser.parse_args()
+
+    totals = []
+    per_package = defaultdict(list)
+    for _ in range(args.runs):
+        total, packages = measure(args.module)
+        totals.append(total)
+        for package, cumulative in packages.items():
+            per_package[package].append(cumulative)
+
+    median_total = statistics.median(totals) / 1000
+    own = median_total - sum(statistics.median(v) for v in per_package.values()) / 1000
+    rows = sorted(((statistics.median(v) / 1000, package) for package, v in per_package.items()), reverse=True)
+
+    print(f"Import of '{args.module}': {median_total:.1f} ms (median of {args.runs})")
+    print(f"  {'package':30} {'ms':>8} {'share':>7}")
+    for ms, package in rows[:args.top]:
+        print(f"  {package:30} {ms:>8.1f} {100 * ms / median_total:>6.1f}%")
+    remaining = sum(ms for ms, _ in rows[args.top:])
+    if remaining:
+        print(f"  {'(other imports)':30} {remaining:>8.1f} {100 * remaining / median_total:>6.1f}%")
+    print(f"  {'(module body)':30} {own:>8.1f} {100 * own / median_total:>6.1f}%")
+
+    if args.budget_ms is not None:
+        if median_total > args.budget_ms:
+            print(f"\nOver budget: {median_total:.1f} ms > {args.budget_ms:.1f} ms")
+            return 1
+        print(f"\nWithin budget: {median_total:.1f} ms <= {args.budget_ms:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
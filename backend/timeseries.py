@@ -0,0 +1,178 @@
+"""Bucketed time series with automatic granularity and LTTB downsampling.
+
+Charts ask for a window and a target point count. The coarsest granularity
+that still yields at least that many buckets is picked, so a request never
+aggregates far more buckets than it returns, and buckets are aggregated from raw events on every request: with a columnar scan of the
+analytics mirror when it is synced, or a MongoDB aggregation otherwise. There
+is no pre-computed rollup. Empty buckets are zero-filled and the series is
+reduced with Largest-Triangle-Three-Buckets so its shape survives at
+~``points`` samples.
+"""
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+# Finest first
+GRANULARITY_SECONDS = {
+    'minute': 60,
+    '5minutes': 300,
+    '15minutes': 900,
+    'hour': 3600,
+    '6hours': 21600,
+    'day': 86400,
+}
+
+MEASURES = ('count', 'cost', 'tokens')
+
+# Naive datetimes are stored as UTC by pymongo
+EPOCH = datetime(1970, 1, 1)
+
+TIMESERIES_MAX_BUCKETS = int(os.environ.get('TIMESERIES_MAX_BUCKETS', '20000'))
+
+
+class TimeSeriesError(ValueError):
+    """Raised for invalid time-series requests"""
+
+
+def as_utc(value: datetime) -> datetime:
+    """Aware UTC datetime; naive values are taken to be UTC"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def epoch_seconds(value: datetime) -> int:
+    return int(as_utc(value).timestamp())
+
+
+def choose_granularity(start: datetime, end: datetime, requested: Optional[str] = None, points: int = 500) -> str:
+    """Coarsest granularity giving at least ``points`` buckets within TIMESERIES_MAX_BUCKETS"""
+    span = max(1, epoch_seconds(end) - epoch_seconds(start))
+    if requested and requested != 'auto':
+        if requested not in GRANULARITY_SECONDS:
+            raise TimeSeriesError(f"Unknown granularity: {requested}")
+        if span / GRANULARITY_SECONDS[requested] > TIMESERIES_MAX_BUCKETS:
+            raise TimeSeriesError(f"Too many {requested} buckets for this window; use a coarser granularity")
+        return requested
+    fitting = [(name, seconds) for name, seconds in GRANULARITY_SECONDS.items() if span / seconds <= TIMESERIES_MAX_BUCKETS]
+    if not fitting:
+        return 'day'
+    for granularity, seconds in reversed(fitting):
+        if span / seconds >= points:
+            return granularity
+    # Short windows can't fill ``points`` buckets at any granularity
+    return fitting[0][0]
+
+
+def fill_buckets(
+    rows: List[Tuple[int, int, float, int]],
+    start: datetime,
+    end: datetime,
+    step: int
+) -> List[List[float]]:
+    """Zero-fill (bucket, count, cost, tokens) rows over [start, end]"""
+    by_bucket = {int(row[0]): (row[1], row[2], row[3]) for row in rows}
+    first = epoch_seconds(start) // step * step
+    last = epoch_seconds(end) // step * step
+    series = []
+    for bucket in range(first, last + 1, step):
+        count, cost, tokens = by_bucket.get(bucket, (0, 0.0, 0))
+        series.append([bucket, count or 0, cost or 0.0, tokens or 0])
+    return series
+
+
+def lttb(xs: List[float], ys: List[float], threshold: int) -> List[int]:
+    """Largest-Triangle-Three-Buckets; returns the indices of the points to keep"""
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    selected = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        span = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / span
+        avg_y = sum(ys[next_start:next_end]) / span
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        ax, ay = xs[a], ys[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
+
+
+def downsample(series: List[List[float]], measure: str, points: int) -> List[List[float]]:
+    """Reduce the series to about ``points`` buckets, shaped by ``measure``"""
+    column = MEASURES.index(measure) + 1
+    keep = lttb([row[0] for row in series], [row[column] for row in series], points)
+    return [series[i] for i in keep]
+
+
+def columnar_query(step: int, filters: Dict[str, Any], start: datetime, end: datetime):
+    """SQL for bucketed totals over the analytics mirror"""
+    from analytics_engine import dimension_expression, _naive_utc
+
+    where, params = ["ts >= ?", "ts <= ?"], [_naive_utc(start), _naive_utc(end)]
+    for name, value in filters.items():
+        where.append(f"{dimension_expression(name)} = ?")
+        params.append(getattr(value, 'value', value))
+    # Truncate fractional seconds like the MongoDB path; a plain cast would round
+    sql = (
+        f"SELECT CAST(floor(epoch(ts)) AS BIGINT) // {int(step)} * {int(step)} AS bucket, "
+        "count(*), coalesce(sum(cost_usd), 0), coalesce(sum(total_tokens), 0) "
+        f"FROM events WHERE {' AND '.join(where)} GROUP BY bucket"
+    )
+    return sql, params, ['bucket', 'count', 'cost', 'tokens']
+
+
+def mongo_pipeline(step: int, match: Dict[str, Any], refs: Dict[str, str], compact: bool) -> List[Dict[str, Any]]:
+    """Aggregation computing bucketed totals; buckets are epoch seconds"""
+    # Date minus Date is milliseconds since the epoch
+    millis = {"$subtract": [refs["timestamp"], EPOCH]}
+    tokens = refs["total_tokens"]
+    if compact:
+        # Compact documents omit total_tokens when it equals the sum of its parts
+        tokens = {"$cond": [
+            {"$eq": [{"$type": tokens}, "missing"]},
+            {"$add": [refs["prompt_tokens"], refs["completion_tokens"]]},
+            tokens
+        ]}
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": {"$subtract": [millis, {"$mod": [millis, step * 1000]}]},
+            "count": {"$sum": 1},
+            "cost": {"$sum": refs["cost_usd"]},
+            "tokens": {"$sum": tokens}
+        }},
+        {"$project": {
+            "bucket": {"$divide": ["$_id", 1000]},
+            "count": 1,
+            "cost": 1,
+            "tokens": 1,
+            "_id": 0
+        }}
+    ]
+
+
+def format_points(series: List[List[float]]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "timestamp": datetime.fromtimestamp(bucket, tz=timezone.utc),
+            "count": int(count),
+            "cost": round(cost, 6),
+            "tokens": int(tokens),
+        }
+        for bucket, count, cost, tokens in series
+    ]
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""Offline token counting for events that arrive without token counts.
+
+OpenAI models are counted with their own BPE encoding; other providers don't
+publish an offline tokenizer, so their text is counted with cl100k_base as a
+close approximation. Encodings are read from a local cache directory and
+never downloaded at request time. Provision the cache at build time with
+
+    python token_counting.py download
+
+When tiktoken or the cached encodings are missing, counts fall back to a
+character-based estimate. Each encoding is loaded once per process, and
+counts are memoized by content hash so repeated prompts (system prompts,
+templates, retries) are never encoded twice.
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+ROOT_DIR = Path(__file__).parent
+
+TOKENIZER_CACHE_DIR = os.environ.get('TOKENIZER_CACHE_DIR', str(ROOT_DIR / 'tokenizers'))
+TOKEN_COUNT_CACHE_SIZE = int(os.environ.get('TOKEN_COUNT_CACHE_SIZE', '50000'))
+TOKENIZER_THREADS = int(os.environ.get('TOKENIZER_THREADS', '4'))
+
+ENCODING_URLS = {
+    'cl100k_base': 'https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken',
+    'o200k_base': 'https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken',
+}
+
+# OpenAI model prefixes per encoding, most specific first
+OPENAI_ENCODINGS = [
+    (('gpt-4o', 'gpt-4.1', 'gpt-4.5', 'gpt-5', 'chatgpt-4o', 'o1', 'o3', 'o4'), 'o200k_base'),
+    (('gpt-4', 'gpt-3.5', 'text-embedding-3', 'text-embedding-ada'), 'cl100k_base'),
+]
+DEFAULT_ENCODING = 'cl100k_base'
+HEURISTIC = 'heuristic'
+
+_encoders: Dict[str, object] = {}
+_encoder_lock = threading.Lock()
+_counts: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+_counts_lock = threading.Lock()
+
+
+def tokenizer_family(provider: str, model: str) -> str:
+    """Encoding used to count tokens for a provider's model"""
+    if provider == 'openai':
+        model = model.lower()
+        for prefixes, encoding in OPENAI_ENCODINGS:
+            if model.startswith(prefixes):
+                return encoding
+    return DEFAULT_ENCODING
+
+
+def encoding_cached(name: str) -> bool:
+    # tiktoken caches each encoding file under the SHA-1 of its URL
+    key = hashlib.sha1(ENCODING_URLS[name].encode()).hexdigest()
+    return os.path.exists(os.path.join(TOKENIZER_CACHE_DIR, key))
+
+
+def get_encoder(family: str):
+    """Load an encoding once per process; None when it isn't available offline"""
+    if family in _encoders:
+        return _encoders[family]
+    with _encoder_lock:
+        if family in _encoders:
+            return _encoders[family]
+        encoder = None
+        if encoding_cached(family):
+            try:
+                os.environ['TIKTOKEN_CACHE_DIR'] = TOKENIZER_CACHE_DIR
+                import tiktoken
+                encoder = tiktoken.get_encoding(family)
+            except ImportError:
+                logging.warning("tiktoken is not installed, token counts are estimated")
+            except Exception as e:
+                logging.warning(f"Tokenizer {family} not loaded, token counts are estimated: {e}")
+        else:
+            logging.warning(f"Tokenizer {family} is not cached in {TOKENIZER_CACHE_DIR}, token counts are estimated")
+        _encoders[family] = encoder
+        return encoder
+
+
+def tokenizer_name(family: str) -> str:
+    return family if get_encoder(family) is not None else HEURISTIC
+
+
+def estimate_tokens(text: str) -> int:
+    """About four characters or three quarters of a word per token, whichever gives more"""
+    return max((len(text) + 3) // 4, (len(text.split()) * 4 + 2) // 3)
+
+
+def encode_counts(family: str, texts: List[str]) -> List[int]:
+    encoder = get_encoder(family)
+    if encoder is None:
+        return [estimate_tokens(text) for text in texts]
+    if len(texts) == 1:
+        return [len(encoder.encode_ordinary(texts[0]))]
+    return [len(tokens) for tokens in encoder.encode_ordinary_batch(texts, num_threads=TOKENIZER_THREADS)]
+
+
+def count_tokens(items: List[Tuple[str, str, str]]) -> List[int]:
+    """Token counts for (family, text hash, text) items.
+
+    Memoized counts are reused; the rest are encoded in one batch per family.
+    """
+    counts: List[Optional[int]] = [None] * len(items)
+    misses: Dict[str, List[int]] = {}
+    with _counts_lock:
+        for i, (family, text_hash, _) in enumerate(items):
+            key = (family, text_hash)
+            count = _counts.get(key)
+            if count is None:
+                misses.setdefault(family, []).append(i)
+            else:
+                _counts.move_to_end(key)
+                counts[i] = count
+
+    for family, positions in misses.items():
+        # Encode each distinct text once even when it repeats within the batch
+        unique: Dict[str, str] = {}
+        for i in positions:
+            unique.setdefault(items[i][1], items[i][2])
+        encoded = dict(zip(unique, encode_counts(family, list(unique.values()))))
+        for i in positions:
+            counts[i] = encoded[items[i][1]]
+        with _counts_lock:
+            for text_hash, count in encoded.items():
+                _counts[(family, text_hash)] = count
+            while len(_counts) > TOKEN_COUNT_CACHE_SIZE:
+                _counts.popitem(last=False)
+    return counts
+
+
+def warm_tokenizers() -> None:
+    """Load the encodings up front so the first request doesn't pay for it"""
+    for family in ENCODING_URLS:
+        get_encoder(family)
+
+
+def download() -> int:
+    """Fetch the encodings into TOKENIZER_CACHE_DIR (needs network; run at build time)"""
+    os.environ['TIKTOKEN_CACHE_DIR'] = TOKENIZER_CACHE_DIR
+    import tiktoken
+    for name in ENCODING_URLS:
+        tiktoken.get_encoding(name)
+        print(f"{name}: cached in {TOKENIZER_CACHE_DIR}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['download'], help="cache the encodings for offline use")
+    parser.parse_args()
+    return download()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -135,19 +135,119 @@ class AIUsageAnalyzerTester:
             
             if success:
                 data = response.json()
-                if isinstance(data, list) and len(data) == 2:
-                    for event in data:
-                        self.created_event_ids.append(event.get('id'))
-                    details += f", Created {len(data)} events"
+                results = data.get('results', [])
+                if data.get('inserted') == 2 and len(results) == 2:
+                    for result in results:
+                        self.created_event_ids.append(result.get('id'))
+                    details += f", Created {data.get('inserted')} events"
                 else:
                     success = False
-                    details += f", Expected 2 events, got {len(data) if isinstance(data, list) else 'non-list'}"
+                    details += f", Expected 2 inserted events, got {data.get('inserted')}"
                     
             return self.log_test("Create Batch Events", success, details)
             
         except Exception as e:
             return self.log_test("Create Batch Events", False, f"Error: {str(e)}")
 
+    def test_batch_idempotent_retry(self):
+        """Test that retried batches report duplicates and invalid items per item"""
+        try:
+            event_id = f"retry-test-{int(time.time() * 1000)}"
+            batch_data = {
+                "events": [
+                    {
+                        "id": event_id,
+                        "provider": "openai",
+                        "model": "gpt-4",
+                        "event_type": "text_generation",
+                        "user_id": "test-user-retry",
+                        "service": "retry-test-service",
+                        "total_tokens": 100
+                    },
+                    {
+                        "provider": "not-a-provider",
+                        "model": "gpt-4",
+                        "event_type": "text_generation",
+                        "user_id": "test-user-retry",
+                        "service": "retry-test-service"
+                    }
+                ]
+            }
+            
+            first = requests.post(
+                f"{self.api_url}/v1/ai-usage/events/batch",
+                json=batch_data,
+                headers=self.headers,
+                timeout=10
+            )
+            second = requests.post(
+                f"{self.api_url}/v1/ai-usage/events/batch",
+                json=batch_data,
+                headers=self.headers,
+                timeout=10
+            )
+            
+            success = first.status_code == 200 and second.status_code == 200
+            details = f"Status: {first.status_code}/{second.status_code}"
+            
+            if success:
+                first_statuses = [r.get('status') for r in first.json().get('results', [])]
+                second_statuses = [r.get('status') for r in second.json().get('results', [])]
+                self.created_event_ids.append(event_id)
+                success = first_statuses == ['inserted', 'invalid'] and second_statuses == ['duplicate', 'invalid']
+                details += f", First: {first_statuses}, Retry: {second_statuses}"
+                
+            return self.log_test("Batch Idempotent Retry", success, details)
+            
+        except Exception as e:
+            return self.log_test("Batch Idempotent Retry", False, f"Error: {str(e)}")
+
+    def test_server_token_counting(self):
+        """Test that events without token counts are counted and costed server-side"""
+        try:
+            batch_data = {
+                "events": [
+                    {
+                        "provider": provider,
+                        "model": model,
+                        "event_type": "text_generation",
+                        "user_id": "test-user-tokens",
+                        "service": "token-count-test-service",
+                        "prompt": "Summarize the quarterly usage report for the platform team",
+                        "response": "Usage grew steadily across all services this quarter"
+                    }
+                    for provider, model in [("openai", "gpt-4o"), ("anthropic", "claude-3-sonnet")]
+                ]
+            }
+            
+            response = requests.post(
+                f"{self.api_url}/v1/ai-usage/events/batch",
+                json=batch_data,
+                headers=self.headers,
+                timeout=10
+            )
+            
+            success = response.status_code == 200
+            details = f"Status: {response.status_code}"
+            
+            if success:
+                events = [r.get('event') or {} for r in response.json().get('results', [])]
+                for event in events:
+                    if event.get('id'):
+                        self.created_event_ids.append(event['id'])
+                counted = [e for e in events if e.get('prompt_tokens') and e.get('completion_tokens')
+                           and e.get('total_tokens') and e.get('cost_usd')]
+                if len(counted) == 2:
+                    details += f", Tokens: {[e['total_tokens'] for e in counted]}, Source: {counted[0]['metadata'].get('token_count_source')}"
+                else:
+                    success = False
+                    details += f", Token counts missing: {[(e.get('prompt_tokens'), e.get('total_tokens')) for e in events]}"
+                    
+            return self.log_test("Server Token Counting", success, details)
+            
+        except Exception as e:
+            return self.log_test("Server Token Counting", False, f"Error: {str(e)}")
+
     def test_get_events(self):
         """Test retrieving events with filters"""
         try:
@@ -188,6 +288,50 @@ class AIUsageAnalyzerTester:
         except Exception as e:
             return self.log_test("Get Events", False, f"Error: {str(e)}")
 
+    def test_search_events(self):
+        """Test full-text search over redacted prompts"""
+        try:
+            marker = f"searchmarker{int(time.time())}"
+            event_data = {
+                "provider": "openai",
+                "model": "gpt-4",
+                "event_type": "text_generation",
+                "user_id": "test-user-search",
+                "service": "search-test-service",
+                "prompt": f"Investigate the {marker} refund escalation"
+            }
+            create_response = requests.post(
+                f"{self.api_url}/v1/ai-usage/events",
+                json=event_data,
+                headers=self.headers,
+                timeout=10
+            )
+            if create_response.status_code == 200:
+                self.created_event_ids.append(create_response.json().get('id'))
+            
+            response = requests.get(
+                f"{self.api_url}/v1/ai-usage/events?q={marker}&service=search-test-service",
+                headers=self.headers,
+                timeout=10
+            )
+            
+            success = response.status_code == 200
+            details = f"Status: {response.status_code}"
+            
+            if success:
+                data = response.json()
+                matches = [e for e in data if marker in (e.get('redacted_prompt') or '')]
+                if len(data) == 1 and matches:
+                    details += f", Found event {data[0].get('id', '')[:8]}..."
+                else:
+                    success = False
+                    details += f", Expected 1 match, got {len(data)}"
+                    
+            return self.log_test("Search Events", success, details)
+            
+        except Exception as e:
+            return self.log_test("Search Events", False, f"Error: {str(e)}")
+
     def test_get_analytics(self):
         """Test analytics endpoint"""
         try:
@@ -221,6 +365,154 @@ class AIUsageAnalyzerTester:
         except Exception as e:
             return self.log_test("Get Analytics", False, f"Error: {str(e)}")
 
+    def test_analytics_query(self):
+        """Test ad-hoc analytics query endpoint"""
+        try:
+            query = {
+                "dimensions": ["service", "model"],
+                "measures": ["count", "cost"],
+                "granularity": "hour",
+                "order_by": "-cost",
+                "limit": 20
+            }
+            response = requests.post(
+                f"{self.api_url}/v1/ai-usage/analytics/query",
+                json=query,
+                headers=self.headers,
+                timeout=10
+            )
+            
+            success = response.status_code == 200
+            details = f"Status: {response.status_code}"
+            
+            if success:
+                data = response.json()
+                expected_columns = ['bucket', 'service', 'model', 'count', 'cost']
+                if data.get('columns') != expected_columns:
+                    success = False
+                    details += f", Unexpected columns: {data.get('columns')}"
+                else:
+                    details += f", Rows: {data.get('row_count')}, Elapsed: {data.get('elapsed_ms')}ms"
+                    
+            return self.log_test("Analytics Query", success, details)
+            
+        except Exception as e:
+            return self.log_test("Analytics Query", False, f"Error: {str(e)}")
+
+    def test_get_timeseries(self):
+        """Test downsampled time-series endpoint"""
+        try:
+            response = requests.get(
+                f"{self.api_url}/v1/ai-usage/timeseries?days=7&points=200",
+                headers=self.headers,
+                timeout=10
+            )
+            
+            success = response.status_code == 200
+            details = f"Status: {response.status_code}"
+            
+            if success:
+                data = response.json()
+                points = data.get('points', [])
+                if data.get('granularity') in ('minute', '5minutes', '15minutes', 'hour', '6hours', 'day') and 0 < len(points) <= 200:
+                    details += f", Granularity: {data['granularity']}, Points: {len(points)}/{data.get('raw_points')}"
+                else:
+                    success = False
+                    details += f", Unexpected series: {data.get('granularity')} with {len(points)} points"
+                    
+            return self.log_test("Get Time Series", success, details)
+            
+        except Exception as e:
+            return self.log_test("Get Time Series", False, f"Error: {str(e)}")
+
+    def test_get_alerts(self):
+        """Test alert rules and alert listing endpoints"""
+        try:
+            rules_response = requests.get(
+                f"{self.api_url}/v1/ai-usage/alerts/rules",
+                headers=self.headers,
+                timeout=10
+            )
+            alerts_response = requests.get(
+                f"{self.api_url}/v1/ai-usage/alerts?limit=10",
+                headers=self.headers,
+                timeout=10
+            )
+            
+            success = rules_response.status_code == 200 and alerts_response.status_code == 200
+            details = f"Status: {rules_response.status_code}/{alerts_response.status_code}"
+            
+            if success:
+                rules = rules_response.json()
+                alerts = alerts_response.json()
+                if isinstance(rules, list) and isinstance(alerts, list):
+                    details += f", Rules: {len(rules)}, Recent alerts: {len(alerts)}"
+                else:
+                    success = False
+                    details += ", Response is not a list"
+                    
+            return self.log_test("Get Alerts", success, details)
+            
+        except Exception as e:
+            return self.log_test("Get Alerts", False, f"Error: {str(e)}")
+
+    def test_admission_stats(self):
+        """Test ingestion admission counters endpoint"""
+        try:
+            response = requests.get(
+                f"{self.api_url}/v1/ai-usage/admission/stats",
+                headers=self.headers,
+                timeout=10
+            )
+            
+            success = response.status_code == 200
+            details = f"Status: {response.status_code}"
+            
+            if success:
+                data = response.json()
+                required_fields = ['inflight_writes', 'throttled_requests', 'overloaded_requests', 'top_throttled']
+                missing_fields = [field for field in required_fields if field not in data]
+                if missing_fields:
+                    success = False
+                    details += f", Missing fields: {missing_fields}"
+                else:
+                    details += f", Throttled: {data['throttled_requests']}, Overloaded: {data['overloaded_requests']}"
+                    
+            return self.log_test("Admission Stats", success, details)
+            
+        except Exception as e:
+            return self.log_test("Admission Stats", False, f"Error: {str(e)}")
+
+    def test_spool_stats(self):
+        """Test ingest spool depth and replay rate endpoint"""
+        try:
+            response = requests.get(
+                f"{self.api_url}/v1/ai-usage/spool/stats",
+                headers=self.headers,
+                timeout=10
+            )
+            
+            success = response.status_code == 200
+            details = f"Status: {response.status_code}"
+            
+            if success:
+                data = response.json()
+                if not data.get('enabled'):
+                    details += ", Spool disabled"
+                else:
+                    required_fields = ['pending_events', 'pending_bytes', 'replay_rate_per_second', 'database_down']
+                    missing_fields = [field for field in required_fields if field not in data]
+                    if missing_fields:
+                        success = False
+                        details += f", Missing fields: {missing_fields}"
+                    else:
+                        details += f", Pending: {data['pending_events']}, Replay rate: {data['replay_rate_per_second']}/s"
+                    
+            return self.log_test("Spool Stats", success, details)
+            
+        except Exception as e:
+            return self.log_test("Spool Stats", False, f"Error: {str(e)}")
+
     def test_generate_demo_data(self):
         """Test demo data generation"""
         try:
@@ -391,12 +683,20 @@ class AIUsageAnalyzerTester:
         # Core functionality
         self.test_create_single_event()
         self.test_create_batch_events()
+        self.test_batch_idempotent_retry()
+        self.test_server_token_counting()
         self.test_get_events()
+        self.test_search_events()
         self.test_get_analytics()
+        self.test_analytics_query()
+        self.test_get_timeseries()
         
         # Advanced features
         self.test_pii_detection()
         self.test_cost_calculation()
+        self.test_get_alerts()
+        self.test_admission_stats()
+        self.test_spool_stats()
         self.test_generate_demo_data()
         
         # Error handling
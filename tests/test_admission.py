@@ -0,0 +1,108 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from admission import AdmissionController, AdmissionRejected, TokenBucket, event_costs  # noqa: E402
+
+
+def controller(**overrides):
+    limits = {"user_rate": 1.0, "user_burst": 5.0, "service_rate": 0.0, "service_burst": 0.0, "max_inflight": 2}
+    limits.update(overrides)
+    return AdmissionController(**limits)
+
+
+def test_token_bucket_refills_up_to_burst():
+    bucket = TokenBucket(rate=2.0, burst=10.0, now=0.0)
+    bucket.tokens = 0.0
+    bucket.refill(1.5)
+    assert bucket.tokens == 3.0
+    bucket.refill(100.0)
+    assert bucket.tokens == 10.0
+
+
+def test_token_bucket_wait_time():
+    bucket = TokenBucket(rate=2.0, burst=10.0, now=0.0)
+    assert bucket.wait_time(10) == 0.0
+    bucket.tokens = 4.0
+    assert bucket.wait_time(8) == 2.0
+    # A batch larger than the burst only waits for a full bucket
+    assert bucket.wait_time(25) == 3.0
+
+
+def test_batch_larger_than_burst_goes_into_debt():
+    admission = controller()
+    admission.admit({("user_id", "big"): 12}, now=0.0)
+    bucket = admission.buckets[("user_id", "big")]
+    assert bucket.tokens == -7.0
+
+    # The debt is paid off at the refill rate before the next event fits
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.admit({("user_id", "big"): 1}, now=2.0)
+    assert rejected.value.retry_after == 6.0
+    assert rejected.value.retry_after_header == "6"
+    admission.admit({("user_id", "big"): 1}, now=8.0)
+
+
+def test_admit_is_all_or_nothing():
+    admission = controller(service_rate=1.0, service_burst=3.0)
+    admission.admit({("user_id", "u1"): 2, ("service", "svc"): 2}, now=0.0)
+    with pytest.raises(AdmissionRejected):
+        # The user bucket has room, the service bucket doesn't
+        admission.admit({("user_id", "u2"): 2, ("service", "svc"): 2}, now=0.0)
+    assert admission.buckets[("user_id", "u2")].tokens == 5.0
+    assert admission.buckets[("service", "svc")].tokens == 1.0
+    assert admission.buckets[("service", "svc")].throttled == 1
+    assert admission.buckets[("user_id", "u2")].throttled == 0
+    assert admission.totals["throttled"] == 1 and admission.totals["admitted"] == 1
+
+
+def test_rate_of_zero_disables_the_limit():
+    admission = controller(user_rate=0.0)
+    for _ in range(100):
+        admission.admit({("user_id", "u1"): 50}, now=0.0)
+    assert admission.buckets == {}
+
+
+def test_least_recently_seen_buckets_are_evicted():
+    admission = controller(max_keys=2)
+    for key in ("a", "b", "a", "c"):
+        admission.admit({("user_id", key): 1}, now=0.0)
+    assert list(admission.buckets) == [("user_id", "a"), ("user_id", "c")]
+
+
+def test_write_slots_are_capped_with_retry_after():
+    admission = controller(max_inflight=2)
+    admission.write_seconds = 0.5
+    first = admission.acquire_write_slot()
+    admission.acquire_write_slot()
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.acquire_write_slot()
+    assert rejected.value.retry_after == 0.5
+    assert rejected.value.retry_after_header == "1"
+    assert admission.totals["overloaded"] == 1
+
+    admission.release_write_slot(first)
+    assert admission.inflight == 1
+    admission.acquire_write_slot()
+    assert admission.inflight == 2
+
+
+def test_zero_max_inflight_disables_the_cap():
+    admission = controller(max_inflight=0)
+    for _ in range(100):
+        admission.acquire_write_slot()
+    assert admission.inflight == 100
+
+
+def test_event_costs_counts_events_per_user_and_service():
+    costs = event_costs([
+        {"user_id": "u1", "service": "svc"},
+        {"user_id": "u1", "service": "other"},
+        {"user_id": None, "service": "svc"},
+        {"user_id": 42},
+        "not an event",
+    ])
+    assert costs == {("user_id", "u1"): 2, ("service", "svc"): 2, ("service", "other"): 1}
@@ -0,0 +1,124 @@
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from alerts import AlertEvaluator, AlertRule, SlidingWindow  # noqa: E402
+
+BASE = datetime(2025, 1, 1, tzinfo=timezone.utc)
+T0 = BASE.timestamp()
+
+
+def event(seconds, **fields):
+    return {"timestamp": BASE + timedelta(seconds=seconds), "user_id": "u1", "service": "svc", **fields}
+
+
+def budget_rule(**overrides):
+    rule = {"name": "budget", "kind": "budget", "scope": "user_id", "threshold": 2.0, "window_seconds": 600}
+    rule.update(overrides)
+    return AlertRule(**rule)
+
+
+def rate_rule(**overrides):
+    rule = {
+        "name": "rate", "kind": "rate_change", "scope": "service", "measure": "events",
+        "threshold": 3, "window_seconds": 600, "min_baseline": 2,
+    }
+    rule.update(overrides)
+    return AlertRule(**rule)
+
+
+def test_sliding_window_rotates_current_into_previous():
+    window = SlidingWindow(600, 60)
+    for i in range(5):
+        window.add(T0 + i, 1)
+    assert (window.current, window.previous) == (5, 0)
+
+    # One window later the first five buckets are the previous window
+    window.add(T0 + 600, 1)
+    assert (window.current, window.previous) == (1, 5)
+
+    # Another window later the first five have expired
+    window.add(T0 + 1200, 2)
+    assert (window.current, window.previous) == (2, 1)
+
+    # A jump past both windows clears the ring
+    window.add(T0 + 5000, 3)
+    assert (window.current, window.previous) == (3, 0)
+
+
+def test_sliding_window_rejects_values_older_than_the_ring():
+    window = SlidingWindow(600, 60)
+    assert window.add(T0 + 1200, 1)
+    assert window.add(T0 + 500, 1)
+    assert (window.current, window.previous) == (1, 1)
+    assert not window.add(T0, 1)
+
+
+def test_budget_fires_when_window_total_exceeds_threshold():
+    evaluator = AlertEvaluator([budget_rule(cooldown_seconds=0)])
+    assert evaluator.observe(event(0, cost_usd=1.0)) == []
+    assert evaluator.observe(event(1, cost_usd=1.0)) == []
+    alerts = evaluator.observe(event(2, cost_usd=0.5))
+    assert [(a.rule, a.key, a.value, a.baseline) for a in alerts] == [("budget", "u1", 2.5, None)]
+
+
+def test_rate_change_compares_against_previous_window():
+    evaluator = AlertEvaluator([rate_rule()])
+    for i in range(3):
+        assert evaluator.observe(event(i)) == []
+    fired = []
+    for i in range(10):
+        fired += evaluator.observe(event(600 + i))
+    assert [(a.value, a.baseline) for a in fired] == [(10.0, 3.0)]
+
+
+def test_rate_change_ignores_baseline_below_min_baseline():
+    evaluator = AlertEvaluator([rate_rule(min_baseline=5)])
+    for i in range(3):
+        evaluator.observe(event(i))
+    fired = []
+    for i in range(20):
+        fired += evaluator.observe(event(600 + i))
+    assert fired == []
+
+
+def test_cooldown_suppresses_repeats_until_it_expires():
+    evaluator = AlertEvaluator([budget_rule(cooldown_seconds=300)])
+    assert len(evaluator.observe(event(0, cost_usd=5.0))) == 1
+    assert evaluator.observe(event(10, cost_usd=5.0)) == []
+    assert len(evaluator.observe(event(310, cost_usd=5.0))) == 1
+
+
+def test_emit_false_rebuilds_windows_without_alerting():
+    evaluator = AlertEvaluator([budget_rule()])
+    assert evaluator.observe(event(0, cost_usd=5.0), emit=False) == []
+    assert evaluator.events_observed == 1
+    assert len(evaluator.observe(event(1, cost_usd=0.1))) == 1
+
+
+def test_restore_cooldowns_from_stored_alerts():
+    evaluator = AlertEvaluator([budget_rule(cooldown_seconds=300)])
+    evaluator.restore_cooldowns([
+        {"rule": "budget", "key": "u1", "triggered_at": BASE},
+        # Naive timestamps as read back from MongoDB are UTC
+        {"rule": "budget", "key": "u2", "triggered_at": BASE.replace(tzinfo=None) - timedelta(seconds=200)},
+    ])
+    assert evaluator.observe(event(100, cost_usd=5.0)) == []
+    assert len(evaluator.observe(event(150, cost_usd=5.0, user_id="u2"))) == 1
+    assert len(evaluator.observe(event(301, cost_usd=5.0))) == 1
+
+
+def test_least_recently_seen_keys_are_evicted_with_their_cooldown():
+    evaluator = AlertEvaluator([budget_rule(cooldown_seconds=3600)], max_keys=3)
+    assert len(evaluator.observe(event(0, user_id="u0", cost_usd=5.0))) == 1
+    for i in range(1, 4):
+        evaluator.observe(event(i, user_id=f"u{i}", cost_usd=0.1))
+    assert list(evaluator.windows[0]) == ["u1", "u2", "u3"]
+    assert ("budget", "u0") not in evaluator.last_fired
+
+    # Seeing a key again makes it the most recent
+    evaluator.observe(event(5, user_id="u1", cost_usd=0.1))
+    evaluator.observe(event(6, user_id="u4", cost_usd=0.1))
+    assert list(evaluator.windows[0]) == ["u3", "u1", "u4"]
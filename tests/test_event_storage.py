@@ -0,0 +1,113 @@
+import argparse
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import event_storage  # noqa: E402
+from event_storage import (  # noqa: E402
+    COMPRESSED_PROMPT_KEY, OFFLOADED_PROMPT_KEY, PROMPTS_COLLECTION, decode_event, encode_event
+)
+
+
+def make_event(**overrides):
+    event = {
+        "id": "evt-1",
+        "timestamp": datetime(2025, 1, 1, tzinfo=timezone.utc),
+        "provider": "anthropic",
+        "model": "claude-3",
+        "event_type": "text_generation",
+        "user_id": "user-1",
+        "service": "svc",
+        "prompt_tokens": 10,
+        "completion_tokens": 5,
+        "total_tokens": 15,
+        "cost_usd": 0.01,
+        "prompt_hash": None,
+        "response_hash": None,
+        "metadata": {},
+        "has_pii": False,
+        "redacted_prompt": "hello",
+        "s3_key": None,
+    }
+    event.update(overrides)
+    return event
+
+
+def stored(event):
+    """The event as decode_event returns it: empty and default fields are not stored"""
+    return {k: v for k, v in event.items() if v is not None and v != {} and v is not False}
+
+
+def test_legacy_encoding_is_unchanged():
+    event = make_event()
+    doc, prompt = encode_event(event, compact=False)
+    assert doc == event and prompt is None
+    assert decode_event(doc) == event
+
+
+def test_compact_round_trip_derives_total_tokens_and_codes_enums():
+    event = make_event()
+    doc, prompt = encode_event(event, compact=True, prompt_storage="inline")
+    assert prompt is None
+    assert "tt" not in doc
+    assert doc["p"] == 2 and doc["et"] == 1
+    assert doc["_id"] == "evt-1" and doc["rp"] == "hello"
+    assert decode_event(doc) == stored(event)
+
+
+def test_compact_keeps_total_tokens_that_are_not_derivable():
+    event = make_event(total_tokens=20)
+    doc, _ = encode_event(event, compact=True, prompt_storage="inline")
+    assert doc["tt"] == 20
+    assert decode_event(doc)["total_tokens"] == 20
+
+    # A missing total must not be filled in from its parts on the way back
+    doc, _ = encode_event(make_event(total_tokens=None), compact=True, prompt_storage="inline")
+    assert decode_event(doc)["total_tokens"] is None
+
+
+def test_compact_compresses_long_prompts_only():
+    long_prompt = "lorem ipsum " * 100
+    doc, _ = encode_event(make_event(redacted_prompt=long_prompt), compact=True, prompt_storage="compress")
+    assert COMPRESSED_PROMPT_KEY in doc and "rp" not in doc
+    assert decode_event(doc)["redacted_prompt"] == long_prompt
+
+    doc, _ = encode_event(make_event(), compact=True, prompt_storage="compress")
+    assert COMPRESSED_PROMPT_KEY not in doc and doc["rp"] == "hello"
+
+
+def test_compact_offloads_prompts():
+    doc, prompt = encode_event(make_event(), compact=True, prompt_storage="offload")
+    assert doc[OFFLOADED_PROMPT_KEY] is True and "rp" not in doc
+    assert prompt == {"_id": "evt-1", "rp": "hello"}
+    assert decode_event(doc, prompts={"evt-1": "hello"})["redacted_prompt"] == "hello"
+    assert event_storage.offloaded_ids([doc]) == ["evt-1"]
+
+
+def test_unknown_enum_code_decodes_as_other():
+    doc, _ = encode_event(make_event(), compact=True, prompt_storage="inline")
+    doc["p"] = 99
+    assert decode_event(doc)["provider"] == "other"
+
+
+def test_migrate_rerun_restores_lost_prompts():
+    mongomock = pytest.importorskip("mongomock")
+    import migrate_compact_storage
+
+    db = mongomock.MongoClient()["migrate_test"]
+    db.ai_usage_events.insert_many([make_event(id=f"evt-{i}", redacted_prompt=f"prompt {i}") for i in range(5)])
+    args = argparse.Namespace(
+        source="ai_usage_events", target="ai_usage_events_compact", prompt_storage="offload", batch_size=2
+    )
+    assert migrate_compact_storage.migrate(db, args) == 0
+    assert db[PROMPTS_COLLECTION].count_documents({}) == 5
+
+    # A prompt lost by the first run is offloaded again although its event is a duplicate
+    db[PROMPTS_COLLECTION].delete_one({"_id": "evt-3"})
+    assert migrate_compact_storage.migrate(db, args) == 0
+    assert db.ai_usage_events_compact.count_documents({}) == 5
+    assert db[PROMPTS_COLLECTION].find_one({"_id": "evt-3"})["rp"] == "prompt 3"
@@ -0,0 +1,118 @@
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "import_events_test")
+os.environ.setdefault("ANALYTICS_ENGINE", "off")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import import_events  # noqa: E402
+
+
+def write_events(path, count):
+    with open(path, "w") as f:
+        for i in range(count):
+            f.write(json.dumps({
+                "provider": "openai",
+                "model": "gpt-4",
+                "event_type": "text_generation",
+                "user_id": f"user-{i % 5}",
+                "service": "import-test",
+                "total_tokens": 10,
+                "timestamp": "2025-01-01T00:00:00Z",
+            }) + "\n")
+
+
+def import_args(tmp_path, restart):
+    return argparse.Namespace(
+        checkpoint=str(tmp_path / "import.checkpoint"),
+        restart=restart,
+        rejects=None,
+        workers=2,
+        writers=2,
+        chunk_size=10,
+        collection="ai_usage_events",
+        source_id=None,
+    )
+
+
+@pytest.fixture
+def db():
+    database = mongomock.MongoClient()["import_events_test"]
+    if not import_events.COMPACT_STORAGE:
+        database.ai_usage_events.create_index("id", unique=True)
+    return database
+
+
+def test_line_ids_are_stable_per_source_offset_and_content():
+    line = b'{"user_id": "u"}\n'
+    assert import_events.line_id("a", 0, line) == import_events.line_id("a", 0, line)
+    assert import_events.line_id("a", 0, line) != import_events.line_id("a", 120, line)
+    assert import_events.line_id("a", 0, line) != import_events.line_id("b", 0, line)
+    assert import_events.line_id("a", 0, line) != import_events.line_id("a", 0, b'{"user_id": "v"}\n')
+
+
+def test_source_identity_ignores_path_and_compression(tmp_path):
+    path = tmp_path / "events.jsonl"
+    write_events(path, 5)
+    with open(path, "rb") as f, gzip.open(tmp_path / "copy.jsonl.gz", "wb") as out:
+        shutil.copyfileobj(f, out)
+    assert import_events.source_identity(str(path)) == import_events.source_identity(str(tmp_path / "copy.jsonl.gz"))
+
+
+def test_reimport_of_moved_file_does_not_duplicate(db, tmp_path):
+    path = tmp_path / "events.jsonl"
+    write_events(path, 20)
+    import_events.import_file(db, str(path), import_args(tmp_path, restart=True))
+
+    moved = tmp_path / "archive" / "renamed.jsonl"
+    moved.parent.mkdir()
+    shutil.move(path, moved)
+    state = import_events.import_file(db, str(moved), import_args(tmp_path / "archive", restart=True))
+    assert state["inserted"] == 0
+    assert state["duplicates"] == 20
+    assert db.ai_usage_events.count_documents({}) == 20
+
+
+def test_resume_after_lost_checkpoint_does_not_duplicate(db, tmp_path):
+    path = tmp_path / "events.jsonl"
+    write_events(path, 50)
+
+    state = import_events.import_file(db, str(path), import_args(tmp_path, restart=True))
+    assert state["inserted"] == 50
+    assert db.ai_usage_events.count_documents({}) == 50
+
+    # Chunks written but not checkpointed before a crash are read again on resume
+    os.remove(tmp_path / "import.checkpoint")
+    state = import_events.import_file(db, str(path), import_args(tmp_path, restart=False))
+    assert state["inserted"] == 0
+    assert state["duplicates"] == 50
+    assert db.ai_usage_events.count_documents({}) == 50
+
+
+def test_resume_from_checkpoint_skips_written_lines(db, tmp_path):
+    path = tmp_path / "events.jsonl"
+    write_events(path, 30)
+    import_events.import_file(db, str(path), import_args(tmp_path, restart=True))
+
+    with open(path, "a") as f:
+        f.write(json.dumps({
+            "provider": "openai",
+            "model": "gpt-4",
+            "event_type": "text_generation",
+            "user_id": "user-late",
+            "service": "import-test",
+        }) + "\n")
+    state = import_events.import_file(db, str(path), import_args(tmp_path, restart=False))
+    assert state["lines"] == 31
+    assert state["inserted"] == 31
+    assert db.ai_usage_events.count_documents({}) == 31
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "spool_test")
+os.environ.setdefault("ANALYTICS_ENGINE", "off")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from spool import EventSpool, SpoolFull, SpoolLocked, encode_record  # noqa: E402
+
+
+def payloads(*ids):
+    return [json.dumps({"id": i}) for i in ids]
+
+
+def segment_files(path):
+    return sorted(p.name for p in Path(path).glob("segment-*.log"))
+
+
+def replay_all(spool, limit=100):
+    replayed = []
+
+    async def handler(records):
+        replayed.extend(record["id"] for record in records)
+        return {"inserted": len(records)}
+
+    async def run():
+        while await spool.replay_once(handler, limit):
+            pass
+
+    asyncio.run(run())
+    return replayed
+
+
+@pytest.fixture
+def spool_dir(tmp_path):
+    return str(tmp_path / "spool")
+
+
+def test_torn_tail_record_is_skipped_on_restart(spool_dir):
+    spool = EventSpool(spool_dir)
+    spool.append(payloads("a", "b"))
+    torn = Path(spool_dir) / segment_files(spool_dir)[-1]
+    spool.close()
+    with open(torn, "ab") as f:
+        f.write(encode_record(json.dumps({"id": "c"}))[:-6])
+
+    spool = EventSpool(spool_dir)
+    assert spool.pending_records == 2
+    # The torn segment is never appended to again
+    spool.append(payloads("d"))
+    assert len(segment_files(spool_dir)) == 2
+    assert replay_all(spool) == ["a", "b", "d"]
+    assert spool.totals["corrupt"] == 1
+    spool.close()
+
+
+def test_corrupt_record_is_skipped(spool_dir):
+    spool = EventSpool(spool_dir)
+    spool.append(payloads("a"))
+    with open(Path(spool_dir) / segment_files(spool_dir)[-1], "ab") as f:
+        f.write(b"00000000 {\"id\": \"bad\"}\n")
+    spool.segments[spool.active] = os.path.getsize(Path(spool_dir) / segment_files(spool_dir)[-1])
+    spool.append(payloads("b"))
+    assert replay_all(spool) == ["a", "b"]
+    assert spool.totals["corrupt"] == 1
+    spool.close()
+
+
+def test_rotation_and_drained_segments_are_deleted(spool_dir):
+    spool = EventSpool(spool_dir, segment_bytes=64)
+    for i in range(6):
+        spool.append(payloads(f"event-{i}"))
+    # Two 27-byte records fit in a segment
+    assert len(segment_files(spool_dir)) == 3
+
+    assert replay_all(spool, limit=4) == [f"event-{i}" for i in range(6)]
+    # Only a fresh, empty active segment is left
+    files = segment_files(spool_dir)
+    assert len(files) == 1
+    assert os.path.getsize(Path(spool_dir) / files[0]) == 0
+    assert spool.pending_records == 0 and spool.pending_bytes == 0
+    spool.close()
+
+
+def test_cursor_resumes_after_reopening(spool_dir):
+    spool = EventSpool(spool_dir)
+    spool.append(payloads("a", "b", "c"))
+    records, cursor, lines = spool.read_batch(2)
+    assert [record["id"] for record in records] == ["a", "b"]
+    spool.commit(cursor, lines)
+    spool.close()
+
+    spool = EventSpool(spool_dir)
+    assert spool.pending_records == 1
+    assert replay_all(spool) == ["c"]
+    spool.close()
+
+
+def test_empty_tail_segment_is_reused(spool_dir):
+    for _ in range(3):
+        EventSpool(spool_dir).close()
+    assert segment_files(spool_dir) == ["segment-000000000001.log"]
+
+    spool = EventSpool(spool_dir)
+    spool.append(payloads("a"))
+    spool.close()
+    spool = EventSpool(spool_dir)
+    assert len(segment_files(spool_dir)) == 2
+    spool.close()
+
+
+def test_spool_full_rejects_appends(spool_dir):
+    spool = EventSpool(spool_dir, max_bytes=100)
+    spool.append(payloads("a"))
+    with pytest.raises(SpoolFull):
+        spool.append(payloads("x" * 100))
+    assert spool.totals["rejected"] == 1
+    assert spool.pending_records == 1
+    spool.close()
+
+
+def test_directory_is_locked_to_one_process(spool_dir):
+    spool = EventSpool(spool_dir)
+    with pytest.raises(SpoolLocked):
+        EventSpool(spool_dir)
+    spool.close()
+    EventSpool(spool_dir).close()
+
+
+def test_replay_counts_duplicates(monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import server
+
+    db = mongomock_motor.AsyncMongoMockClient()["spool_test"]
+    monkeypatch.setattr(server, "db", db)
+    event = {"provider": "openai", "model": "gpt-4", "event_type": "other", "user_id": "u", "service": "s"}
+    records = [json.loads(server.AIUsageEvent(**event, id=f"event-{i}").json()) for i in range(3)]
+
+    async def run():
+        if not server.COMPACT_STORAGE:
+            await db.ai_usage_events.create_index("id", unique=True)
+        await db.ai_usage_events.insert_one(server.encode_event(server.AIUsageEvent(**records[0]).dict())[0])
+        return await server.replay_spooled_events(records)
+
+    assert asyncio.run(run()) == {"inserted": 2, "duplicates": 1, "failed": 0}
+    assert server.admission.inflight == 0
@@ -0,0 +1,54 @@
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from timeseries import TimeSeriesError, choose_granularity, downsample, fill_buckets  # noqa: E402
+
+END = datetime(2025, 1, 8, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("days, points, expected", [
+    (7, 500, "15minutes"),
+    (7, 100, "hour"),
+    (1, 200, "5minutes"),
+    (365, 300, "day"),
+    (365, 1000, "6hours"),
+    (365, 2000, "hour"),
+])
+def test_auto_granularity_is_the_coarsest_with_enough_points(days, points, expected):
+    assert choose_granularity(END - timedelta(days=days), END, "auto", points) == expected
+
+
+def test_short_windows_use_the_finest_granularity():
+    assert choose_granularity(END - timedelta(hours=1), END, "auto", 500) == "minute"
+
+
+def test_auto_granularity_stays_within_max_buckets():
+    # 'hour' would give ~29k buckets; the coarser '6hours' is used instead
+    assert choose_granularity(END - timedelta(hours=6 * 4999), END, "auto", 5000) == "6hours"
+
+
+def test_requested_granularity_is_validated():
+    assert choose_granularity(END - timedelta(days=1), END, "hour") == "hour"
+    with pytest.raises(TimeSeriesError):
+        choose_granularity(END - timedelta(days=1), END, "week")
+    with pytest.raises(TimeSeriesError):
+        choose_granularity(END - timedelta(days=365), END, "minute")
+
+
+def test_fill_buckets_zero_fills_and_downsample_keeps_endpoints():
+    start = END - timedelta(hours=10)
+    first = int(start.timestamp())
+    series = fill_buckets([(first + 3600 * 4, 7, 1.5, 100)], start, END, 3600)
+    assert len(series) == 11
+    assert series[4] == [first + 3600 * 4, 7, 1.5, 100]
+    assert series[0] == [first, 0, 0.0, 0]
+
+    reduced = downsample(series, "count", 5)
+    assert len(reduced) == 5
+    assert reduced[0] == series[0] and reduced[-1] == series[-1]
+    assert series[4] in reduced
@@ -0,0 +1,56 @@
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "token_counting_test")
+os.environ.setdefault("ANALYTICS_ENGINE", "off")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+import token_counting  # noqa: E402
+from server import AIUsageEventCreate, enrich_usage_events  # noqa: E402
+
+EVENT = {"provider": "openai", "model": "gpt-4o", "event_type": "text_generation", "user_id": "u", "service": "s"}
+
+
+def test_tokenizer_family_per_model():
+    assert token_counting.tokenizer_family("openai", "gpt-4o-mini") == "o200k_base"
+    assert token_counting.tokenizer_family("openai", "gpt-4-turbo") == "cl100k_base"
+    assert token_counting.tokenizer_family("anthropic", "claude-3") == token_counting.DEFAULT_ENCODING
+
+
+def test_missing_counts_are_filled_and_memoized(monkeypatch):
+    calls = []
+    real_encode_counts = token_counting.encode_counts
+
+    def encode_counts(family, texts):
+        calls.append(len(texts))
+        return real_encode_counts(family, texts)
+
+    monkeypatch.setattr(token_counting, "encode_counts", encode_counts)
+    batch = [AIUsageEventCreate(**EVENT, prompt="a repeated prompt for counting", response="ok") for _ in range(3)]
+    events = [event for event, _ in enrich_usage_events(batch)]
+    assert all(event.prompt_tokens and event.completion_tokens for event in events)
+    assert all(event.total_tokens == event.prompt_tokens + event.completion_tokens for event in events)
+    assert events[0].metadata["token_count_source"] == token_counting.tokenizer_name("o200k_base")
+    # Each distinct text is encoded once per batch and then served from the memo
+    assert calls == [2]
+    enrich_usage_events(batch)
+    assert calls == [2]
+
+
+def test_reported_counts_are_not_recounted(monkeypatch):
+    monkeypatch.setattr(server, "count_tokens", lambda items: [999] * len(items))
+    event, _ = enrich_usage_events([AIUsageEventCreate(**EVENT, prompt="hello", response="hi", total_tokens=7)])[0]
+    assert (event.prompt_tokens, event.completion_tokens, event.total_tokens) == (None, None, 7)
+    assert "token_count_source" not in event.metadata
+
+    event, _ = enrich_usage_events([AIUsageEventCreate(**EVENT, prompt="hello", response="hi", prompt_tokens=3)])[0]
+    assert (event.prompt_tokens, event.completion_tokens, event.total_tokens) == (3, 999, 1002)
+
+
+def test_estimate_without_tokenizer():
+    assert token_counting.estimate_tokens("") == 0
+    assert token_counting.estimate_tokens("abcd" * 10) == 10
+    assert token_counting.estimate_tokens("a b c d e f") == 8